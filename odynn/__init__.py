@@ -1,14 +1,6 @@
 import os
 os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
 
-# Use on my server
-import matplotlib as mpl
-if "SSH_CONNECTION" in os.environ:
-    mpl.use("Agg")
+# matplotlib is set up by utils at its first use
 from .utils import COLORS
 # mpl.rcParams['axes.prop_cycle'] = mpl.cycler(color=COLORS)
-# Tune the plots appearance
-import pylab as plt
-SMALL_SIZE = 8
-plt.rc('xtick', labelsize=SMALL_SIZE)    # fontsize of the tick labels
-plt.rc('ytick', labelsize=SMALL_SIZE)    # fontsize of the tick labels
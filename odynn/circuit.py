@@ -7,18 +7,15 @@
 import random
 
 import numpy as np
-import scipy as sp
-import pandas as pd
-import tensorflow as tf
-import pylab as plt
-import networkx as nx
-import matplotlib.pyplot as plt
-from matplotlib.patches import ArrowStyle
-import seaborn as sns
 
 from . import utils, neuron
+from .utils import plt, sns, pd, tf, LazyModule
 from .optim import Optimized
 
+nest = LazyModule('tensorflow.python.util.nest')
+nx = LazyModule('networkx')
+patches = LazyModule('matplotlib.patches')
+
 SYNAPSE1 = {
     'G': 0.2,
     'mdp': -30.,
@@ -197,6 +194,9 @@ class Circuit:
         self.n_synapse = len(syns[0])
         self.n_gap = len(gaps_c[0])
         self._param = self._init_p.copy()
+        # connections grouped by postsynaptic neuron, to sum the currents each neuron receives in one call
+        self._post_order = np.argsort(self._posts, kind='stable')
+        self._post_ids, self._post_starts = np.unique(self._posts[self._post_order], return_index=True)
 
         nb_neurons = len(np.unique(np.hstack((self._pres,self._posts))))
         if nb_neurons != self._neurons.num:
@@ -239,7 +239,7 @@ class Circuit:
         if self._tensors:
             g = G * tf.sigmoid((vprev - mdp) / scale)
         else:
-            g = G / (1 + sp.exp((mdp - vprev) / scale))
+            g = G / (1 + np.exp((mdp - vprev) / scale))
         return g * (self._param['E'] - vpost)
 
     def _inter_curr(self, vprev, vpost):
@@ -274,41 +274,24 @@ class Circuit:
             ndarray or tf.Tensor: updated state vector
         """
         if self._tensors:
-            # update synapses
             #curs : [batch, neuron(, model)]
-            #hprev : [state, batch, neuron(, model)] -> [state, neuron, batch(, model)]
+            #hprev : [state, batch, neuron(, model)]
 
             # if use extra init parameters
             try:
                 hprev, extra = hprev
             except:
                 extra = None
-            ndim = 3 if self._num == 1 else 4
-            perm_h = [0, 2, 1, 3][:ndim]
-            perm_v = [1, 0, 2][:ndim-1]
-
-            hprev_swap = tf.transpose(hprev, perm_h)
-            idx_pres = np.stack((np.zeros(self._pres.shape, dtype=np.int32), self._pres), axis=1)
-            idx_post = np.stack((np.zeros(self._pres.shape, dtype=np.int32), self._posts), axis=1)
-            #[neuron, batch(, model)] -> [batch, neuron(, model)]
 
-            vpres = tf.transpose(tf.gather_nd(hprev_swap, idx_pres), perm=perm_v)
-            vposts = tf.transpose(tf.gather_nd(hprev_swap, idx_post), perm=perm_v)
-
-            #voltage of the presynaptic cells
+            # voltages of the pre and postsynaptic cells : [batch, connection(, model)]
+            v = hprev[self._neurons.V_pos]
+            vpres = tf.gather(v, self._pres, axis=1)
+            vposts = tf.gather(v, self._posts, axis=1)
             curs_intern = self._inter_curr(vpres, vposts)
-            # [batch, neuron(, model)] -> [neuron, batch(, model)]
-            curs_intern = tf.transpose(curs_intern, perm=perm_v)
-            curs_post = []
-            for i in range(self._neurons.num):
-                # 0 synaptic current if no synapse coming in
-                if i in self._posts:
-                    # [batch(, model)]
-                    current_in = tf.reduce_sum(tf.gather_nd(curs_intern, np.argwhere(self._posts == i)), axis=0)
-                else:
-                    current_in = tf.reduce_sum(tf.zeros(tf.shape(curs)), axis=1)
-                curs_post.append(current_in)
-            final_curs = tf.add_n([tf.stack(curs_post, axis=1), curs])
+            # sum by postsynaptic neuron, 0 synaptic current if no synapse coming in
+            # [batch, connection(, model)] -> [batch * neuron(, model)] -> [batch, neuron(, model)]
+            curs_post = tf.unsorted_segment_sum(curs_intern, self._post_segments, self._n_segments)
+            final_curs = tf.reshape(curs_post, tf.shape(v)) + curs
             try:
                 h = self._neurons.step(hprev, final_curs)
             except:
@@ -329,41 +312,103 @@ class Circuit:
                 vpres = h[0, self._pres]
                 vposts = h[0, self._posts]
                 curs_intern = self._inter_curr(vpres, vposts)
-            curs_post = np.zeros(curs.shape)
-
-            if self._num > 1:
-                curs_post = np.swapaxes(curs_post, -2, -1)
-            for i in range(self._neurons.num):
-                if i not in self._posts:
-                    curs_post[...,i] = 0
-                    continue
-                curs_post[...,i] = np.sum(curs_intern[self._posts == i], axis=0)
-            if self._num > 1:
-                curs_post = np.swapaxes(curs_post, -2, -1)
-            return h, curs_post
-
-    def calculate(self, i_inj):
+            # curs_intern : [connection, (batch)(, model)] -> [neuron, (batch)(, model)]
+            curs_post = np.zeros((self._neurons.num,) + curs_intern.shape[1:], dtype=np.result_type(curs, curs_intern))
+            curs_post[self._post_ids] = np.add.reduceat(curs_intern[self._post_order], self._post_starts, axis=0)
+            # [neuron, (batch)(, model)] -> [(batch), neuron(, model)]
+            return h, np.moveaxis(curs_post, 0, curs_post.ndim - (2 if self._num > 1 else 1))
+
+    def calculate(self, i_inj, record=None, every=1, neurons=None, init_state=None, return_state=False):
         """
         Simulate the circuit with a given input current.
 
         Args:
             i_inj(ndarray): input current
+            record(list of int): If not None, positions of the state variables to record (Default value = None)
+            every(int): record the state every `every` time steps, starting with the first one (Default value = 1)
+            neurons(list of int): If not None, neurons to record, like `n_out` (Default value = None)
+            init_state(list of ndarray): If not None, state to start from, as returned with `return_state`: a list
+                of the state of the neurons followed, optionally, by the synaptic currents of the previous step, as
+                for `CircuitTf.calculate` (Default value = None, the initial state of the neurons and no synaptic
+                current)
+            return_state(bool): If True, also return the final state, as a list of the state of the neurons and of
+                the synaptic currents, to continue the simulation later (Default value = False)
+
+        Returns:
+            ndarray, ndarray: state vector and synaptical currents, and the final state if `return_state`
+        """
+        h, c = self._start(init_state)
+        states, curs, h, c = self._calculate(i_inj, h, c, record, every, neurons)
+        if return_state:
+            return states, curs, [h, c]
+        return states, curs
+
+    def _start(self, init_state):
+        """Give the state of the neurons and the synaptic currents to start a simulation from"""
+        if init_state is None:
+            return self._neurons.init_state, None
+        if isinstance(init_state, np.ndarray):
+            raise ValueError('The state to start from is a list of the state of the neurons and of the synaptic '
+                             'currents')
+        h, c = (list(init_state) + [None])[:2]
+        return h, c
+
+    def _record(self, x, neurons):
+        """Select the recorded neurons of a state vector or of the synaptic currents"""
+        if neurons is None:
+            return x
+        return np.take(x, neurons, axis=x.ndim - (2 if self._num > 1 else 1))
+
+    def _calculate(self, i_inj, h, c, record=None, every=1, neurons=None, start=0):
+        """Simulate the circuit from the state `h` and the synaptic currents `c` of the previous step, as in
+        `calculate`, `start` being the number of time steps already simulated
 
         Returns:
-            ndarray, ndarray: state vector and synaptical currents
+            ndarray, ndarray, ndarray, ndarray: recorded states and synaptic currents, final state and synaptic
+            currents
         """
+        self._neurons._update_prep()
         states = []#np.zeros((np.hstack((len(i_inj), self.neurons.init_state.shape))))
         curs = []#np.zeros(i_inj.shape)
-        h = self._neurons.init_state
 
         for t in range(len(i_inj)):
-            if t == 0:
+            if c is None:
                 h, c = self.step(h, curs=i_inj[t])
             else:
-                h, c = self.step(h, curs=i_inj[t] + curs[t - 1])
-            curs.append(c)
-            states.append(h)
-        return np.stack(states, axis=0), np.stack(curs, axis=0)
+                h, c = self.step(h, curs=i_inj[t] + c)
+            if (start + t) % every == 0:
+                curs.append(self._record(c, neurons))
+                states.append(self._record(h if record is None else h[record], neurons))
+        if not states:
+            h_rec = self._record(h if record is None else h[record], neurons)
+            return np.zeros((0,) + h_rec.shape), np.zeros((0,) + self._record(c, neurons).shape), h, c
+        return np.stack(states, axis=0), np.stack(curs, axis=0), h, c
+
+    def simulate_iter(self, currents, chunk=None, record=None, every=1, neurons=None, init_state=None):
+        """
+        Simulate the circuit with an input current given by pieces, e.g. a long recording read from a file.
+        The states of the neurons and the synaptic currents are carried from a chunk to the next one, so that only
+        the states of one chunk are in memory.
+
+        Args:
+            currents(ndarray or iterable of ndarray): input current of shape [time, (batch,) neuron], or its
+                successive pieces along the time axis
+            chunk(int): If not None, number of time steps of the chunks the pieces are regrouped in, else the
+                pieces are simulated as they come (Default value = None)
+            record(list of int): If not None, positions of the state variables to record (Default value = None)
+            every(int): record the state every `every` time steps of the whole simulation (Default value = 1)
+            neurons(list of int): If not None, neurons to record (Default value = None)
+            init_state(list of ndarray): If not None, state to start from, as in `calculate` (Default value = None)
+
+        Yields:
+            ndarray, ndarray: recorded state vectors and synaptical currents of the successive chunks
+        """
+        h, c = self._start(init_state)
+        start = 0
+        for i in utils.chunks(currents, chunk):
+            states, curs, h, c = self._calculate(i, h, c, record, every, neurons, start)
+            start += len(i)
+            yield states, curs
 
     def plot(self, show=True, save=False):
         """
@@ -403,8 +448,8 @@ class Circuit:
         edges_exc = [e for e in G.edges if G[e[0]][e[1]][e[2]]['color'] == exc]
         edges_inh = [e for e in G.edges if G[e[0]][e[1]][e[2]]['color'] == inh]
         edges_gap = [e for e in G.edges if G[e[0]][e[1]][e[2]]['color'] == gap]
-        style = ArrowStyle("wedge", tail_width=2., shrink_factor=0.2)
-        styleg = ArrowStyle("wedge", tail_width=0.6, shrink_factor=0.4)
+        style = patches.ArrowStyle("wedge", tail_width=2., shrink_factor=0.2)
+        styleg = patches.ArrowStyle("wedge", tail_width=0.6, shrink_factor=0.4)
         nx.draw_networkx_edges(G, pos, arrowstyle=style, edgelist=edges_exc, edge_color='Chartreuse',
                                arrowsize=10, alpha=1, width=1)
         nx.draw_networkx_edges(G, pos, arrowstyle=style, edgelist=edges_inh, edge_color='red',
@@ -524,12 +569,18 @@ class CircuitTf(Circuit, Optimized):
         state['neurons'] = self._neurons.__getstate__().copy()
         del state['_param']
         del state['_constraints']
+        state.pop('_clips', None)
+        state.pop('_post_segments', None)
+        state.pop('_n_segments', None)
+        state.pop('_simulators', None)
         return state
 
     def __setstate__(self, state):
         self.__dict__.update(state)
         self._param = {}
         self._constraints = {}
+        self._clips = []
+        self._simulators = {}
         self._neurons.__setstate__(state['neurons'])
 
     @property
@@ -556,6 +607,11 @@ class CircuitTf(Circuit, Optimized):
         # print('params', self._neurons.parameter_names)
         self._neurons.init_params = value
 
+    def _feed_values(self, params):
+        values = {var: val for var, val in params.items() if var in self._init_p}
+        values.update(self._neurons._feed_values({var: val for var, val in params.items() if var not in values}))
+        return values
+
     @property
     def variables(self):
         if self._neurons.trainable:
@@ -566,34 +622,49 @@ class CircuitTf(Circuit, Optimized):
     def reset(self):
         """prepare the variables as tensors, prepare the constraints, call reset for self._neurons"""
         self._param = {}
-        self._constraints = []
+        self._clips = []
         for var, val in self._init_p.items():
             self._param[var] = tf.get_variable(var, initializer=val, dtype=tf.float32)
             if var in self.constraints_dic:
                 # add dimension for later
-                con = self.constraints_dic[var]
-                self._constraints.append(tf.assign(self._param[var], tf.clip_by_value(self._param[var], con[0], con[1])))
+                self._clips.append((self._param[var], self.constraints_dic[var]))
+        self._constraints = [tf.assign(v, tf.clip_by_value(v, con[0], con[1])) for v, con in self._clips]
         self._neurons.reset()
         self._init_state = self._neurons.init_state
 
-    def build_graph(self, batch=1):
+    def _structure(self):
+        return Optimized._structure(self) + (self._neurons._structure(),)
+
+    def build_graph(self, batch=1, init_state=None, inputs=None):
+        """
+        Build a tensorflow graph for running the circuit on a series of input
+
+        Args:
+            batch(int): dimension of the batch
+            init_state(callable): if not None, function giving the tensor to start from, given the default
+                initial state of the neurons
+            inputs(callable): if not None, function giving the input tensor to use instead of a placeholder
+
+        Returns:
+            tf.placeholder, tf.Tensor: input placeholder and results of the run
+        """
         tf.reset_default_graph()
         self.reset()
-        xshape = [None]
-        initializer = self._init_state.astype(np.float32)
-
-        xshape.append(None)
-        initializer = np.stack([initializer for _ in range(batch)], axis=1)
+        xshape = [None, None]
 
         self._neurons.init(batch)
         xshape.append(self._neurons.num)
         print("num neurons : ", self._neurons.num)
         if self._num > 1:
-            xshape.append(self._num)
-            # if self.parallel is not None:
-            #     xshape.append(self.parallel)
+            # the input can be shared by all the models
+            xshape.append(None)
+        initializer = self._batch_state(self._init_state, batch, init_state)
         extra_state = self._neurons.hidden_init_state
-        curs_ = tf.placeholder(shape=xshape, dtype=tf.float32, name='input_current')
+        curs_ = self._input(xshape, inputs)
+        # segment of each connection in the flattened [batch * neuron] postsynaptic currents
+        batch_ = tf.shape(curs_)[1]
+        self._post_segments = tf.range(batch_)[:, None] * self._neurons.num + self._posts
+        self._n_segments = batch_ * self._neurons.num
         infer_shape = True
         if extra_state is not None:
             initializer = (initializer, extra_state)
@@ -602,7 +673,8 @@ class CircuitTf(Circuit, Optimized):
         res = tf.scan(self.step,
                       curs_,
                       infer_shape=infer_shape,
-                      initializer=initializer)
+                      initializer=self._feedable_state(initializer))
+        self._final_state(nest.map_structure(lambda r: r[-1], res))
 
         if extra_state is not None:
             res = res[0]
@@ -610,26 +682,27 @@ class CircuitTf(Circuit, Optimized):
         return curs_, res
 
 
-    def calculate(self, i):
+    def calculate(self, i, init_state=None, return_state=False):
         """
         Iterate over i (current) and return the state variables obtained after each step
 
         Args:
           i(ndarray): input current, [time, batch, neuron, model]
+          init_state(list of ndarray): If not None, state to start from, as returned with `return_state`: a list of
+            the state of the neurons followed, optionally, by the hidden state of their networks, as for
+            `Circuit.calculate` (Default value = None, the initial state of the neurons)
+          return_state(bool): If True, also return the final state, as a list of the state of the neurons followed
+            by the hidden state of their networks if any (Default value = False)
 
         Returns:
-            ndarray: state vectors concatenated [i.shape[0], len(self.init_state)(, i.shape[1]), self.num]
+            ndarray: state vectors concatenated [i.shape[0], len(self.init_state)(, i.shape[1]), self.num], and the
+            final state if `return_state`
         """
         if i.ndim > 1 and self._num == 1 or i.ndim > 2 and self._num > 1:
-            input_cur, res_ = self.build_graph(batch=i.shape[1])
+            batch = i.shape[1]
         else:
-            input_cur, res_ = self.build_graph()
-        with tf.Session() as sess:
-            sess.run(tf.global_variables_initializer())
-            results = sess.run(res_, feed_dict={
-                input_cur: i
-            })
-        return results
+            batch = None
+        return self.simulator(batch).run(i, state=init_state, return_state=return_state)
     
     def settings(self):
         """
@@ -654,6 +727,17 @@ class CircuitTf(Circuit, Optimized):
         session.run(self._constraints)
         self._neurons.apply_constraints(session)
 
+    def constraint_ops(self):
+        """
+        Build the ops projecting the synaptic variables and the ones of the neurons on their constraints
+
+        Returns:
+            list of tf.Operation: projection ops
+        """
+        # read in the current context, e.g. after the training step the ops depend on
+        return [tf.assign(v, tf.clip_by_value(v.read_value(), con[0], con[1])) for v, con in self._clips] + \
+               self._neurons.constraint_ops()
+
     def apply_init(self, session):
         self._neurons.apply_init(session)
 
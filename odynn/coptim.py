@@ -5,13 +5,11 @@
 .. moduleauthor:: Marc Javin
 """
 
-import tensorflow as tf
 import numpy as np
 
 from .optim import Optimizer
 from . import utils
-import seaborn as sns
-import pylab as plt
+from .utils import plt, sns, tf
 
 
 class CircuitOpt(Optimizer):
@@ -37,34 +35,43 @@ class CircuitOpt(Optimizer):
           w(list): weights for the voltage and the ions concentrations
 
         """
-        # [time, state, batch, neuron, model]
-        res = []
-        for n in self.n_out:
-            res.append(results[:,:,:,n])
-        res = tf.stack(res, axis=0)
+        # [time, state, batch, neuron(, model)] -> [time, state, batch, n_out(, model)]
+        res = tf.gather(results, self.n_out, axis=3)
+        w_n = self.w_n
         if self._parallel > 1:
-            res = tf.transpose(res, perm=[4, 1, 2, 3, 0])
-        else:
-            res = tf.transpose(res, perm=[1, 2, 3, 0])
-        out = res[..., self.circuit.neurons.V_pos, :, :]
+            # measurements and neuron weights are shared by all models
+            ys_ = [y[..., None] if y is not None else None for y in ys_]
+            if w_n is not None:
+                w_n = np.asarray(w_n, dtype=np.float32)[:, None]
+        out = res[:, self.circuit.neurons.V_pos]
         losses_v = w[0] * tf.square(tf.subtract(out, ys_[self.circuit.neurons.V_pos]))
         losses = losses_v
         for ion, pos in self.optimized._neurons.ions.items():
-            ionc = res[..., pos, :, :]
+            ionc = res[:, pos]
             losses += w[pos] * tf.square(tf.subtract(ionc, ys_[pos]))
         # losses = tf.nn.moments(losses, axes=[-1])[1] + tf.reduce_mean(losses, axis=[-1])
-        if self.w_n is not None:
-            losses = losses * self.w_n
-        self._loss = tf.reduce_mean(losses, axis=[-1, -2, -3])
+        if w_n is not None:
+            losses = losses * w_n
+        # [time, batch, n_out(, model)]
+        self._loss = self._masked_mean(losses, [0, 1, 2], 1)
+
+    def _set_measured(self, state, ys, t):
+        for pos in [self.circuit.neurons.V_pos] + list(self.circuit.neurons.ions.values()):
+            if ys[pos] is not None:
+                # [state, batch, neuron(, model)], measurements of [batch, n_out] shared by all models
+                y = ys[pos][t]
+                s = state[pos]
+                s[:, self.n_out] = y.reshape(y.shape + (1,) * (s.ndim - y.ndim))
 
     def plot_out(self, X, results, res_targ, suffix, step, name, i):
-        for b in range(self.n_batch):
-            res_t = [res_targ[i][:, b] if res_targ[i] is not None else None for i in range(len(res_targ))]
-            self.circuit.plot_output(self.circuit.dt*np.arange(len(X)), X[:, b, 0], results[:, :, b, self.n_out], res_t,
-                                    suffix='trace%s%s_%s' % (name, b, i), show=False, save=True, l=0.8, lt=1.5)
+        plot_traces(self.circuit, self.n_batch, self.n_out, X, results, res_targ, suffix, step, name, i)
+
+    def _plot_job(self):
+        return plot_traces, (self.circuit, self.n_batch, self.n_out)
 
     def optimize(self, subdir, train=None, test=None, w=(1, 0), w_n=None, epochs=700, l_rate=(0.9, 9, 0.95), suffix='',
-                 n_out=[1], evol_var=True, plot=True):
+                 n_out=[1], evol_var=True, plot=True, window=None, shooting=None, w_shooting=1.,
+                 checkpoint=None, batch_size=None, shuffle=True, pipeline=False):
         """Optimize the neuron parameters
 
         Args:
@@ -81,6 +88,22 @@ class CircuitOpt(Optimizer):
             (Default value = [0.1, 9, 0.92]:
           suffix(str): suffix for the saved files (Default value = '')
           n_out(list of int): list of neurons corresponding to the data in train and test
+          window(int): If not None, number of time steps of the windows the traces are split in. The parameters
+            are updated after each window, and the final state of a window starts the next one without
+            backpropagating through it (Default value = None)
+          shooting(int): If not None, number of segments the traces are split in for multiple shooting. The segments
+            are simulated in parallel along the batch axis, from trainable start states initialised with the
+            measurements. Exclusive with window (Default value = None)
+          w_shooting(float): weight of the continuity penalty between segments (Default value = 1.)
+          checkpoint(int): If not None, number of time steps of the chunks whose activations are kept in memory
+            at once. The chunks are run again from stored states to compute the gradients, and the parameters are
+            updated once per epoch. Exclusive with window and shooting (Default value = None)
+          batch_size(int): If not None, number of elements of the batch used for each update. An epoch runs over
+            all the minibatches (Default value = None)
+          shuffle(bool): If True, draw the minibatches in a random order at each epoch (Default value = True)
+          pipeline(bool): If True, keep the training data in the session and feed the runs with a prefetching input
+            pipeline, without copying the current for each parallel model. Not compatible with the checkpointed and
+            multiple shooting modes (Default value = False)
 
         Returns:
             NeuronTf: neuron attribute after optimization
@@ -96,7 +119,31 @@ class CircuitOpt(Optimizer):
         self.n_out = n_out
         yshape = [None, None, len(n_out)]
         print('yshape', yshape)
-        Optimizer.optimize(self, subdir, train, test, w, epochs, l_rate, suffix, yshape=yshape, evol_var=evol_var, plot=plot)
+        Optimizer.optimize(self, subdir, train, test, w, epochs, l_rate, suffix, yshape=yshape, evol_var=evol_var, plot=plot,
+                           window=window, shooting=shooting, w_shooting=w_shooting,
+                           checkpoint=checkpoint, batch_size=batch_size, shuffle=shuffle,
+                           pipeline=pipeline)
+
+
+def plot_traces(circuit, n_batch, n_out, X, results, res_targ, suffix, step, name, i):
+    """Plot the traces of the measured neurons for each element of the batch against the targets
+
+    Args:
+        circuit(CircuitTf): optimized circuit
+        n_batch(int): dimension of the batch
+        n_out(list): indices of the measured neurons
+        X(ndarray): input current
+        results(ndarray): states of the circuit, [time, state, batch, neuron(, model)]
+        res_targ(list): measurements, as in the training data
+        suffix(str): suffix of the optimization
+        step(str): step of the optimization
+        name(str): name of the data, e.g. 'train'
+        i(int): epoch
+    """
+    for b in range(n_batch):
+        res_t = [res_targ[i][:, b] if res_targ[i] is not None else None for i in range(len(res_targ))]
+        circuit.plot_output(circuit.dt*np.arange(len(X)), X[:, b, 0], results[:, :, b, n_out], res_t,
+                            suffix='trace%s%s_%s' % (name, b, i), show=False, save=True, l=0.8, lt=1.5)
 
 
 def plot_heatmap(m, name, suffix, labels, n_out=None):
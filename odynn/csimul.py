@@ -8,11 +8,12 @@
 import numpy as np
 from .circuit import Circuit
 from .neuron import PyBioNeuron
+from . import parallel
 import time
 
 
 def simul(t, i_injs, pars=None, synapses={}, gaps={}, circuit=None, n_out=[0], suffix='', show=False,
-          save=True, labels=None):
+          save=True, labels=None, workers=0):
     """
     Simulate a circuit with input current `i_injs` and return the outputs of neurons contained in `n_out`
 
@@ -28,6 +29,8 @@ def simul(t, i_injs, pars=None, synapses={}, gaps={}, circuit=None, n_out=[0], s
         show(bool): If True, show the plot
         save(bool): If True, save the plot
         labels: labels for the circuit's neurons
+        workers(int): number of processes simulating the batch, 0 to simulate in this process and None for one
+            per processor
 
     Returns:
         list : measurements as a list [time, input currents, [voltage(, calcium)]]
@@ -40,7 +43,10 @@ def simul(t, i_injs, pars=None, synapses={}, gaps={}, circuit=None, n_out=[0], s
     start = time.time()
     curs = None
     try:
-        states, curs = circuit.calculate(i_injs)
+        if workers == 0:
+            states, curs = circuit.calculate(i_injs)
+        else:
+            states, curs = parallel.calculate(circuit, i_injs, workers=workers)
     except:
         states = circuit.calculate(i_injs)
     print('Simulation time : {}'.format(time.time() - start))
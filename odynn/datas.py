@@ -7,27 +7,34 @@
 
 import math
 import numpy as np
-import pandas as pd
-import pylab as plt
-import scipy as sp
-from scipy import signal
-from scipy.interpolate import splrep, splev
-from scipy.signal import savgol_filter
 from random import random as rd
 
+from .utils import plt, pd, LazyModule
+
+signal = LazyModule('scipy.signal')
+interpolate = LazyModule('scipy.interpolate')
+
 DUMP_FILE= 'data'
-plt.rc('ytick', labelsize=8)    # fontsize of the tick labels
 
-try:
-    df = pd.read_csv('data/AVAL1.csv').head(3100)
-except:
-    df = pd.read_csv('../data/AVAL1.csv').head(3100)
+_df = None
+
+
+def _aval():
+    """Recording of AVAL, read at the first use"""
+    global _df
+    if _df is None:
+        try:
+            _df = pd.read_csv('data/AVAL1.csv').head(3100)
+        except:
+            _df = pd.read_csv('../data/AVAL1.csv').head(3100)
+    return _df
+
 
 def check_alpha(show=True):
     """study the hill equation
 
     """
-    d = df.head(1000)
+    d = _aval().head(1000)
     t = d['timeVector']
     i = d['inputCurrent']
     trace = d['trace']
@@ -95,11 +102,12 @@ def get_real_data(delta=500, final_time=4000., dt=0.2, show=False):
     Returns:
 
     """
+    df = _aval()
     # df = df.head(510)
     trace = np.array(df['trace'])*10
 
     unit_time = final_time/delta
-    t = sp.arange(0., final_time, dt)
+    t = np.arange(0., final_time, dt)
     i = np.array(df['inputCurrent']) * 10
     intervals = [0, 0, 420, 1140, 2400]
     curs = np.zeros((len(t), len(intervals)))
@@ -107,10 +115,10 @@ def get_real_data(delta=500, final_time=4000., dt=0.2, show=False):
     for j, st in enumerate(intervals):
         td = np.arange(0., final_time, unit_time)
         ca = trace[st:st + delta]
-        spl = splrep(td, ca, s=0.25)
-        s_ca = splev(t, spl)
-        spli = splrep(td, i[st:st+delta])
-        s_i = splev(t, spli)
+        spl = interpolate.splrep(td, ca, s=0.25)
+        s_ca = interpolate.splev(t, spl)
+        spli = interpolate.splrep(td, i[st:st+delta])
+        s_i = interpolate.splev(t, spli)
         plt.subplot(len(intervals), 1, j + 1)
         plt.plot(td, ca)
         plt.plot(t, s_ca)
@@ -120,12 +128,12 @@ def get_real_data(delta=500, final_time=4000., dt=0.2, show=False):
         plt.show()
     plt.close()
     train = [t, curs, [None, cas]]
-    t_all = sp.arange(0., len(trace)*unit_time, dt)
-    td_all = sp.arange(0., len(trace))*unit_time
-    spl = splrep(td_all, trace, s=0.25)
-    s_ca_all = splev(t_all, spl)
-    spli = splrep(td_all, i)
-    s_i_all = splev(t_all, spli)
+    t_all = np.arange(0., len(trace)*unit_time, dt)
+    td_all = np.arange(0., len(trace))*unit_time
+    spl = interpolate.splrep(td_all, trace, s=0.25)
+    s_ca_all = interpolate.splev(t_all, spl)
+    spli = interpolate.splrep(td_all, i)
+    s_i_all = interpolate.splev(t_all, spli)
     plt.plot(td_all, trace)
     plt.plot(t_all, s_ca_all)
     if (show):
@@ -149,7 +157,7 @@ def give_train(dt=DT, nb_neuron_zero=None, max_t=1200.):
     Returns:
 
     """
-    t = np.array(sp.arange(0.0, max_t, dt))
+    t = np.array(np.arange(0.0, max_t, dt))
     i = 10. * ((t > 100) & (t < 300)) + 20. * ((t > 400) & (t < 600)) + 40. * ((t > 800) & (t < 950))
     i2 = 30. * ((t > 100) & (t < 500)) + 25. * ((t > 800) & (t < 900))
     i3 = np.sum([(10. + (n * 2 / 100)) * ((t > n) & (t < n + 50)) for n in range(100, 1100, 100)], axis=0)
@@ -171,7 +179,7 @@ def give_periodic(t, max_i, size, freq):
 
 
 def give_train2(dt=DT):
-    t = np.array(sp.arange(0.0, 1200., dt))
+    t = np.array(np.arange(0.0, 1200., dt))
     b1 = 40. * t / 1200
     b2 = -b1/2
     b3 = 40. - b1
@@ -191,7 +199,7 @@ def give_test(dt=DT, max_t=1200.):
     Returns:
 
     """
-    t = np.array(sp.arange(0.0, max_t, dt))
+    t = np.array(np.arange(0.0, max_t, dt))
     i1 = (t - 100) * (30. / 100) * ((t > 100) & (t <= 200)) + 30 * ((t > 200) & (t <= 1100)) - (t - 1000) * (
             30. / 100) * ((t > 1000) & (t <= 1100))
     i2 = 30. * ((t > 100) & (t < 300)) + 15. * ((t > 400) & (t < 500)) + 10. * ((t > 700) & (t < 1000))
@@ -204,7 +212,7 @@ def give_test(dt=DT, max_t=1200.):
 
 
 def full4(dt=DT, nb_neuron_zero=None, max_t=1200.):
-    t = np.array(sp.arange(0.0, max_t, dt))
+    t = np.array(np.arange(0.0, max_t, dt))
     i1 = 10. * ((t > 200) & (t < 600))
     i2 = 10. * ((t > 300) & (t < 700))
     i3 = 10. * ((t > 400) & (t < 800))
@@ -227,7 +235,7 @@ def full4(dt=DT, nb_neuron_zero=None, max_t=1200.):
     return t, i_fin
 
 def full4_test(dt=DT, nb_neuron_zero=None, max_t=1200.):
-    t = np.array(sp.arange(0.0, max_t, dt))
+    t = np.array(np.arange(0.0, max_t, dt))
     i1 = 10. * ((t > 100) & (t < 200))
     i2 = 10. * ((t > 500) & (t < 700))
     i3 = 10. * ((t > 500) & (t < 800))
@@ -260,13 +268,13 @@ def test():
 
 
 t_len = 5000.
-t = np.array(sp.arange(0.0, t_len, DT))
+t = np.array(np.arange(0.0, t_len, DT))
 i_inj = 10. * ((t > 100) & (t < 750)) + 20. * ((t > 1500) & (t < 2500)) + 40. * ((t > 3000) & (t < 4000))
 v_inj = 115 * (t / t_len) - np.full(t.shape, 65)
 v_inj_rev = np.full(t.shape, 50) - v_inj
 i_inj = np.array(i_inj, dtype=np.float32)
 
-t_test = np.array(sp.arange(0.0, 2000, DT))
+t_test = np.array(np.arange(0.0, 2000, DT))
 i_test = 10. * ((t_test > 100) & (t_test < 300)) + 20. * ((t_test > 400) & (t_test < 600)) + 40. * (
         (t_test > 800) & (t_test < 950)) + \
          (t_test - 1200) * (50. / 500) * ((t_test > 1200) & (t_test < 1700))
@@ -294,15 +302,15 @@ if __name__ == '__main__':
     # print('lowess+interp : %s'%(t2-t1))
     #
     # t1 = time.time()
-    # exact = splrep(tinit, trace, k=1)
-    # spl = splrep(tinit, trace, s=0.25)
-    # zexact = splev(tinit, exact)
-    # z = splev(tinit, spl)
+    # exact = interpolate.splrep(tinit, trace, k=1)
+    # spl = interpolate.splrep(tinit, trace, s=0.25)
+    # zexact = interpolate.splev(tinit, exact)
+    # z = interpolate.splev(tinit, spl)
     # t2 = time.time()
     # print('splrep : %s' % (t2-t1))
     #
-    # spli = splrep(tinit, i, k=2)
-    # i = splev(tinit, spli)
+    # spli = interpolate.splrep(tinit, i, k=2)
+    # i = interpolate.splev(tinit, spli)
     #
     # plt.subplot(211)
     # plt.plot(tinit, trace, 'r', label='trace')
@@ -9,18 +9,14 @@
 import numpy as np
 import random
 
-import pylab as plt
-import pandas as pd
-import seaborn as sns
-import tensorflow as tf
-from matplotlib import gridspec as gridspec
-from matplotlib.ticker import FormatStrFormatter
 import collections
 
-from odynn.utils import box
+from odynn.utils import box, plt, sns, pd, tf, LazyModule
 from odynn import utils
 from . import model
-from pylab import plt
+
+gridspec = LazyModule('matplotlib.gridspec')
+ticker = LazyModule('matplotlib.ticker')
 
 RATE_COLORS = {'p' : '#00ccff',
                'q' : '#0000ff',
@@ -260,10 +256,19 @@ class CElegansNeuron(model.BioNeuron):
     """default parameters as a dictionnary"""
     _constraints_dic = CONSTRAINTS
     """constraints to be applied when optimizing"""
+    _inplace = True
+    _gates = ('p', 'q', 'n', 'e', 'f')
 
     def __init__(self, init_p=None, tensors=False, dt=0.1):
         model.BioNeuron.__init__(self, init_p=init_p, tensors=tensors, dt=dt)
 
+    def _prepared(self):
+        prep = model.BioNeuron._prepared(self)
+        prep['C_dt'] = self._param['C_m'] / self.dt
+        prep['gE_L'] = self._param['g_L'] * self._param['E_L']
+        prep['decay_k'] = self._param['decay_ca'] / (self._param['decay_ca'] + self.dt)
+        return prep
+
     def _h(self, cac):
         """Channel gating kinetics. Functions of membrane voltage"""
         q = self._inf(cac, 'h')
@@ -294,8 +299,19 @@ class CElegansNeuron(model.BioNeuron):
     def _g_Ca(self, e, f, h):
         return self._param['g_Ca'] * e ** 2 * f * h
 
-    def step(self, X, i_inj):
+    def step(self, X, i_inj, out=None):
+        """Integrate and update the state vector after one time step
+
+        Args:
+          X(ndarray or tf.Tensor): state vector
+          i_inj(ndarray or tf.Tensor): input current
+          out(ndarray): buffer in which to write the new state, can be `X` itself (Default value = None)
+
+        Returns:
+            ndarray or tf.Tensor: updated state vector
+        """
         V = X[self.V_pos]
+        gates = X[1:6]
         p = X[1]
         q = X[2]
         n = X[3]
@@ -303,23 +319,20 @@ class CElegansNeuron(model.BioNeuron):
         f = X[5]
         cac = X[-1]
 
-        if self._tensors:
-            i_inj.set_shape(V.get_shape())
         h = self._h(cac)
-        V = (V * (self._param['C_m']/self.dt) + (i_inj + self._g_Ca(e, f, h) * self._param['E_Ca'] + (self._g_Ks(n) + self._g_Kf(p, q)) * self._param['E_K'] + self._param['g_L'] * self._param['E_L'])) / \
-            ((self._param['C_m']/self.dt) + self._g_Ca(e, f, h) + self._g_Ks(n) + self._g_Kf(p, q) + self._param['g_L'])
+        g_ca = self._g_Ca(e, f, h)
+        g_k = self._g_Ks(n) + self._g_Kf(p, q)
+        c_dt = self._prep['C_dt']
+        V = (V * c_dt + (i_inj + g_ca * self._param['E_Ca'] + g_k * self._param['E_K'] + self._prep['gE_L'])) / \
+            (c_dt + g_ca + g_k + self._param['g_L'])
+        if self._tensors:
+            # the input can be shared by the models, the state keeps its static shape in the loop of tf.scan
+            V.set_shape(X[self.V_pos].get_shape())
 
-        cac = (self._param['decay_ca'] / (self._param['decay_ca']+self.dt)) * (cac - self._i_ca(V, e, f, h)*self._param['rho_ca'])
-        p = self._update_gate(p, 'p', V)
-        q = self._update_gate(q, 'q', V)
-        n = self._update_gate(n, 'n', V)
-        e = self._update_gate(e, 'e', V)
-        f = self._update_gate(f, 'f', V)
+        cac = self._prep['decay_k'] * (cac - g_ca * (V - self._param['E_Ca']) * self._param['rho_ca'])
+        gates = self._update_gates(gates, V)
 
-        if self._tensors:
-            return tf.stack([V, p, q, n, e, f, cac], 0)
-        else:
-            return np.array([V, p, q, n, e, f, cac])
+        return self._pack_gates(V, gates, [cac], out)
 
     # def calculate_exc(self, i_inj):
     #     X = [self._init_state]
@@ -525,7 +538,7 @@ class CElegansNeuron(model.BioNeuron):
             ax = plt.Subplot(fig, subgrid[i])
             func(ax, var[1])  # , 'r')
             ax.set_xlabel([])
-            ax.yaxis.set_major_formatter(FormatStrFormatter('%.1f'))
+            ax.yaxis.set_major_formatter(ticker.FormatStrFormatter('%.1f'))
             if (labs):
                 ax.set_ylabel(var[0])
             if (i == 0):
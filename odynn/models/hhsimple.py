@@ -7,10 +7,9 @@
 
 from .model import BioNeuron
 from odynn import utils
-from pylab import plt
+from odynn.utils import plt, tf
 import random
 import numpy as np
-import tensorflow as tf
 import collections
 
 MIN_TAU = 1.
@@ -34,6 +33,8 @@ class HodgHuxSimple(BioNeuron):
     default_params = collections.OrderedDict(sorted(default_params.items(), key=lambda t: t[0]))
     # Initial value for the voltage
     default_init_state = np.array([-60., 0., 1.])
+    _inplace = True
+    _gates = ('a', 'b')
     _constraints_dic = {'C_m': [0.5, 40.],
                         'g_L': [1e-9, 10.],
                         'g_K': [1e-9, 10.],
@@ -46,24 +47,25 @@ class HodgHuxSimple(BioNeuron):
     def __init__(self, init_p, tensors=False, dt=0.1):
         BioNeuron.__init__(self, init_p=init_p, tensors=tensors, dt=dt)
 
+    def _prepared(self):
+        prep = BioNeuron._prepared(self)
+        prep['dt_C'] = self.dt / self._param['C_m']
+        return prep
+
     def _i_K(self, a, b, V):
         return self._param['g_K'] * a**3 * b * (self._param['E_K'] - V)
 
     def _i_L(self, V):
         return self._param['g_L'] * (self._param['E_L'] - V)
 
-    def step(self, X, i_inj):
+    def step(self, X, i_inj, out=None):
         # Update the voltage
         V = X[0]
         a = X[1]
         b = X[2]
-        V = V + self.dt * (i_inj + self._i_L(V) + self._i_K(a, b, V)) / self._param['C_m']
-        a = self._update_gate(a, 'a', V)
-        b = self._update_gate(b, 'b', V)
-        if self._tensors:
-            return tf.stack([V, a, b], 0)
-        else:
-            return np.array([V, a, b])
+        V = V + self._prep['dt_C'] * (i_inj + self._i_L(V) + self._i_K(a, b, V))
+        gates = self._update_gates(X[1:3], V)
+        return self._pack_gates(V, gates, out=out)
 
     @staticmethod
     def get_random():
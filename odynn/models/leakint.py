@@ -7,10 +7,9 @@
 
 from .model import BioNeuron
 from odynn import utils
-from pylab import plt
+from odynn.utils import plt, tf
 import random
 import numpy as np
-import tensorflow as tf
 
 
 # Class for our new model
@@ -19,25 +18,29 @@ class LeakyIntegrate(BioNeuron):
     default_params = {'C_m': 1., 'g_L': 0.1, 'E_L': -60.}
     # Initial value for the voltage
     default_init_state = np.array([-60.])
+    _inplace = True
     _constraints_dic = {'C_m': [0.5, 40.],
                         'g_L': [1e-9, 10.]}
 
     def __init__(self, init_p, tensors=False, dt=0.1):
         BioNeuron.__init__(self, init_p=init_p, tensors=tensors, dt=dt)
 
+    def _prepared(self):
+        prep = BioNeuron._prepared(self)
+        prep['C_dt'] = self._param['C_m'] / self.dt
+        prep['gE_L'] = self._param['g_L'] * self._param['E_L']
+        prep['den'] = prep['C_dt'] + self._param['g_L']
+        return prep
+
     def _i_L(self, V):
         return self._param['g_L'] * (self._param['E_L'] - V)
 
-    def step(self, X, i_inj):
+    def step(self, X, i_inj, out=None):
         # Update the voltage
         V = X[0]
-        V = (V * (self._param['C_m'] / self.dt) + (i_inj + self._param['g_L'] * self._param['E_L'])) /\
-            ((self._param['C_m'] / self.dt) + self._param['g_L'])
+        V = (V * self._prep['C_dt'] + (i_inj + self._prep['gE_L'])) / self._prep['den']
         # V = V + self.dt*(i_inj + self._i_L(V))/self._param['C_m']
-        if self._tensors:
-            return tf.stack([V])
-        else:
-            return np.array([V])
+        return self._pack([V], out)
 
     @staticmethod
     def get_random():
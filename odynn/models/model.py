@@ -5,14 +5,12 @@
 .. moduleauthor:: Marc Javin
 """
 
-import pylab as plt
-from cycler import cycler
 from abc import ABC, abstractmethod
 import numpy as np
 from odynn import utils
-from odynn.utils import classproperty
-import tensorflow as tf
-import scipy as sp
+from odynn.utils import classproperty, plt, tf, LazyModule
+
+cycler = LazyModule('cycler')
 
 
 class Neuron(ABC):
@@ -83,7 +81,7 @@ class Neuron(ABC):
         custom_cycler = None
         if (states.ndim > 3): # circuit in parallel
             states = np.reshape(np.swapaxes(states,-2,-1), (states.shape[0], states.shape[1], -1))
-            custom_cycler = cycler('color', utils.COLORS.repeat(y_states[cls.V_pos].shape[1]))
+            custom_cycler = cycler.cycler('color', utils.COLORS.repeat(y_states[cls.V_pos].shape[1]))
             y_states = [np.reshape(y, (y.shape[0], -1)) if y is not None else None for y in y_states]
 
         # Plot voltage
@@ -142,6 +140,10 @@ class BioNeuron(Neuron):
     """dict, Constraints to be applied during optimization
         Should be of the form : {<variable_name> : [lower_bound, upper_bound]}
     """
+    _inplace = False
+    """bool, True if `step` accepts an `out` buffer in which to write the new state"""
+    _gates = ()
+    """tuple, names of the gates stored right after the voltage in the state vector, updated at once by `_update_gates`"""
 
     def __new__(cls, *args, **kwargs):
         obj = Neuron.__new__(cls)
@@ -183,6 +185,50 @@ class BioNeuron(Neuron):
         self._init_p = init_p
         self._param = self._init_p.copy()
         self.dt = dt
+        self._prep = {}
+        self._prepared_for = None
+        if not tensors:
+            # with tensorflow, the parameters are prepared once they become tensors
+            self.prepare()
+
+    def prepare(self):
+        """Compute the terms of `step` that only depend on the parameters and the time step.
+        Simulations with `calculate` call it again when the parameters or the time step change, direct calls to
+        `step` need it to be called"""
+        self._prep = self._prepared()
+        self._prepared_for = None if self._tensors else self._prep_key()
+
+    def _prep_key(self):
+        """Give the time step and the values of the parameters the terms of `step` are computed from"""
+        return (self.dt,) + tuple((var, np.shape(val), np.asarray(val).tobytes())
+                                  for var, val in sorted(self._param.items()))
+
+    def _update_prep(self):
+        """Compute the terms of `step` again if the parameters or the time step changed since they were"""
+        if not self._tensors and self._prepared_for != self._prep_key():
+            self.prepare()
+
+    def _prepared(self):
+        """
+        Give the parameter-only terms used at every step. Models extend it with their own terms.
+
+        Returns:
+            dict: for each gate, the relaxation factor dt/(tau+dt) as `<gate>__k`, and if the model defines
+            `_gates`, their midpoints, scales and factors stacked along a first axis as `gates`
+        """
+        prep = {'%s__k' % var[:-len('__tau')]: self.dt / (val + self.dt) for var, val in self._param.items()
+                if var.endswith('__tau')}
+        if self._gates:
+            stack = tf.stack if self._tensors else np.stack
+            gates = tuple(stack([p[g] for g in self._gates]) for p in
+                          ({g: self._param['%s__mdp' % g] for g in self._gates},
+                           {g: self._param['%s__scale' % g] for g in self._gates},
+                           {g: prep['%s__k' % g] for g in self._gates}))
+            # [gate, (neuron), (model)], and for tensorflow its counterpart broadcasting over a batch axis
+            prep['gates'] = gates
+            if self._tensors:
+                prep['gates_batch'] = tuple(g[:, None] for g in gates)
+        return prep
 
     def _inf(self, V, rate):
         """Compute the steady state value of a gate activation rate"""
@@ -191,27 +237,169 @@ class BioNeuron(Neuron):
         if self._tensors:
             return tf.sigmoid((V - mdp) / scale)
         else:
-            return 1 / (1 + sp.exp((mdp - V) / scale))
+            return 1 / (1 + np.exp((mdp - V) / scale))
 
     def _update_gate(self, rate, name, V):
-        tau = self._param['%s__tau'%name]
-        return ((tau * self.dt) / (tau + self.dt)) * ((rate / self.dt) + (self._inf(V, name) / tau))
+        k = self._prep['%s__k' % name]
+        return rate + k * (self._inf(V, name) - rate)
+
+    def _update_gates(self, rates, V):
+        """Update all the gates listed in `_gates` in one operation
+
+        Args:
+          rates(ndarray or tf.Tensor): current values of the gates, of shape [gate, ...]
+          V(ndarray or tf.Tensor): updated voltage
+
+        Returns:
+            ndarray or tf.Tensor: updated gates, of shape [gate, ...]
+        """
+        mdp, scale, k = self._prep['gates']
+        if self._tensors:
+            if len(V.shape) >= len(mdp.shape):
+                mdp, scale, k = self._prep['gates_batch']
+            inf = tf.sigmoid((V - mdp) / scale)
+        else:
+            # align the trailing axes of V with the ones following the gate axis
+            ndim = np.ndim(V)
+            mdp, scale, k, rates = [np.reshape(a, a.shape[:1] + (1,) * (ndim + 1 - a.ndim) + a.shape[1:])
+                                    if a.ndim <= ndim else a for a in (mdp, scale, k, np.asarray(rates))]
+            inf = 1 / (1 + np.exp((mdp - V) / scale))
+        return rates + k * (inf - rates)
+
+    def _pack_gates(self, V, gates, others=(), out=None):
+        """Gather the voltage, the gates and the remaining state variables into a state vector
+
+        Args:
+          V(ndarray or tf.Tensor): updated voltage
+          gates(ndarray or tf.Tensor): updated gates, of shape [gate, ...]
+          others(list): updated state variables following the gates
+          out(ndarray): buffer of shape [state, ...] to fill, a new array is created if None
+
+        Returns:
+            ndarray or tf.Tensor: updated state vector
+        """
+        if self._tensors:
+            return tf.concat([tf.expand_dims(V, 0), gates] + [tf.expand_dims(o, 0) for o in others], 0)
+        n = len(gates)
+        if out is None:
+            out = np.empty((n + 1 + len(others),) + np.shape(gates)[1:], dtype=np.result_type(V, gates, *others))
+        out[0] = V
+        out[1:n + 1] = gates
+        for k, o in enumerate(others):
+            out[n + 1 + k] = o
+        return out
+
+    def _pack(self, states, out=None):
+        """Gather the updated state variables into a state vector, written in `out` if given
 
-    def calculate(self, i_inj):
+        Args:
+          states(list): updated state variables
+          out(ndarray): buffer of shape [state, ...] to fill, a new array is created if None
+
+        Returns:
+            ndarray or tf.Tensor: updated state vector
+        """
+        if self._tensors:
+            return tf.stack(states, 0)
+        if out is None:
+            return np.array(states)
+        for k, s in enumerate(states):
+            out[k] = s
+        return out
+
+    def calculate(self, i_inj, out=None, record=None, every=1, init_state=None, return_state=False):
         """
         Simulate the neuron with input current `i_inj` and return the state vectors
 
         Args:
             i_inj: input currents of shape [time, batch]
+            out(ndarray): preallocated buffer of shape [time, state, batch] in which the states are written.
+                If None, a new one is allocated (Default value = None)
+            record(list of int): If not None, positions of the state variables to record,
+                e.g. [self.V_pos, self.ions['$Ca^{2+}$']] (Default value = None)
+            every(int): record the state every `every` time steps, starting with the first one (Default value = 1)
+            init_state(ndarray): If not None, state to start from, e.g. the final state of a previous simulation
+                (Default value = None, the initial state of the neuron)
+            return_state(bool): If True, also return the final state, to continue the simulation later
+                (Default value = False)
+
+        Returns:
+            ndarray: series of state vectors of shape [time, state, batch], and the final state of shape
+            [state, batch] if `return_state`
+
+        Raises:
+            ValueError: if `out` does not have the expected shape
+
+        """
+        X = self._init_state if init_state is None else np.asarray(init_state)
+        out, X = self._calculate(i_inj, X, out, record, every)
+        if return_state:
+            return out, np.array(X)
+        return out
+
+    def _calculate(self, i_inj, X, out=None, record=None, every=1, start=0):
+        """Simulate the neuron from the state `X`, as in `calculate`, `start` being the number of time steps
+        already simulated
 
         Returns:
-            ndarray: series of state vectors of shape [time, state, batch]
+            ndarray, ndarray: recorded states and final state
+        """
+        self._update_prep()
+        i_inj = np.asarray(i_inj)
+        # from the shape of the input rather than its first step, which an empty chunk does not have
+        shape = np.broadcast(X[0], np.broadcast_to(0., i_inj.shape[1:])).shape
+        n_rec = len(range((-start) % every, len(i_inj), every))
+        rec_shape = (n_rec, len(X) if record is None else len(record)) + shape
+        if out is None:
+            out = np.empty(rec_shape, dtype=np.result_type(X, i_inj))
+        elif out.shape != rec_shape:
+            raise ValueError('The output buffer should be of shape {}, got {}'.format(rec_shape, out.shape))
+        if record is None and every == 1:
+            for t, i in enumerate(i_inj):
+                if self._inplace:
+                    X = self.step(X, i, out=out[t])
+                else:
+                    out[t] = X = self.step(X, i)
+            return out, X
+        # the state is updated in a separate buffer, only copied to `out` when it is recorded
+        state = np.empty((len(X),) + shape, dtype=np.result_type(X, i_inj))
+        state[...] = np.reshape(X, X.shape[:1] + (1,) * (len(shape) + 1 - np.ndim(X)) + X.shape[1:])
+        X = state
+        k = 0
+        for t, i in enumerate(i_inj):
+            if self._inplace:
+                X = self.step(X, i, out=X)
+            else:
+                X = self.step(X, i)
+            if (start + t) % every == 0:
+                out[k] = X if record is None else X[record]
+                k += 1
+        return out, X
+
+    def simulate_iter(self, currents, chunk=None, record=None, every=1, init_state=None):
+        """
+        Simulate the neuron with an input current given by pieces, e.g. a long recording read from a file.
+        The state is carried from a chunk to the next one, so that only the states of one chunk are in memory.
 
+        Args:
+            currents(ndarray or iterable of ndarray): input current of shape [time, (batch)], or its successive
+                pieces along the time axis
+            chunk(int): If not None, number of time steps of the chunks the pieces are regrouped in, else the
+                pieces are simulated as they come (Default value = None)
+            record(list of int): If not None, positions of the state variables to record (Default value = None)
+            every(int): record the state every `every` time steps of the whole simulation (Default value = 1)
+            init_state(ndarray): If not None, state to start from (Default value = None)
+
+        Yields:
+            ndarray: series of recorded state vectors of the successive chunks, of shape [time, state, (batch)]
         """
-        X = [self._init_state]
-        for i in i_inj:
-            X.append(self.step(X[-1], i))
-        return np.array(X[1:])
+        X = self._init_state if init_state is None else np.asarray(init_state)
+        start = 0
+        for i in utils.chunks(currents, chunk):
+            out, X = self._calculate(i, X, record=record, every=every, start=start)
+            X = X.copy()
+            start += len(i)
+            yield out
 
     @classmethod
     def _init_names(cls):
@@ -239,3 +427,5 @@ class BioNeuron(Neuron):
                 self._init_p = {var: np.stack([val for _ in range(n)], axis=-1) for var, val in self._init_p.items()}
         self._init_state = np.stack([self._init_state for _ in range(n)], axis=-1)
         self._param = self._init_p.copy()
+        if not self._tensors:
+            self.prepare()
@@ -7,8 +7,8 @@
 
 
 import numpy as np
-import tensorflow as tf
 
+from .utils import tf
 from .models import cfg_model
 from .models.model import Neuron
 from .optim import Optimized
@@ -110,18 +110,28 @@ class BioNeuronTf(MODEL, NeuronTf):
     def __getstate__(self):
         state = self.__dict__.copy()
         del state['_param']
+        del state['_prep']
         del state['_constraints']
+        state.pop('_clips', None)
+        state.pop('_simulators', None)
         return state
 
     def __setstate__(self, state):
         self.__dict__.update(state)
         self._param = {}
+        self._prep = {}
         self._constraints = {}
+        self._clips = []
+        self._simulators = {}
 
     @property
     def groups(self):
         return self._groups
 
+    def _structure(self):
+        groups = None if self._groups is None else tuple(np.ravel(self._groups).tolist())
+        return NeuronTf._structure(self) + (frozenset(self._fixed), groups)
+
     @property
     def init_params(self):
         """initial model parameters"""
@@ -162,7 +172,7 @@ class BioNeuronTf(MODEL, NeuronTf):
         """rebuild tf variable graph"""
         with(tf.variable_scope(self.id)):
             self._param = {}
-            self._constraints = []
+            self._clips = []
             for var, val in self._init_p.items():
                 if var in self._fixed:
                     if self._groups is None:
@@ -178,12 +188,12 @@ class BioNeuronTf(MODEL, NeuronTf):
                     if var in self._constraints_dic:
                         con = self._constraints_dic[var]
                         if self.groups is None:
-                            self._constraints.append(
-                                tf.assign(vals, tf.clip_by_value(vals, con[0], con[1])))
+                            self._clips.append((vals, con))
                         else:
-                            self._constraints.extend(
-                            [tf.assign(val, tf.clip_by_value(val, con[0], con[1])) for val in vals])
+                            self._clips.extend([(val, con) for val in vals])
                 self._param[var] = tf.stack(vals)
+            self._constraints = self.constraint_ops()
+            self.prepare()
         # print('neuron_params after reset : ', self._param)
 
     def parallelize(self, n):
@@ -207,11 +217,14 @@ class BioNeuronTf(MODEL, NeuronTf):
         else:
             MODEL.parallelize(self, n)
 
-    def build_graph(self, batch=None):
+    def build_graph(self, batch=None, init_state=None, inputs=None):
         """
         Build a tensorflow graph for running the neuron(s) on a series of input
         Args:
             batch(int): dimension of the batch
+            init_state(callable): if not None, function giving the tensor to start from, given the default
+                initial state
+            inputs(callable): if not None, function giving the input tensor to use instead of a placeholder
 
         Returns:
             tf.placeholder, tf.Tensor: input placeholder and results of the run
@@ -219,40 +232,47 @@ class BioNeuronTf(MODEL, NeuronTf):
         tf.reset_default_graph()
         self.reset()
         xshape = [None]
-        initializer = self._init_state
         if batch is not None:
             xshape.append(None)
-            initializer = np.stack([initializer for _ in range(batch)], axis=1)
         if self._num > 1:
-            xshape.append(self._num)
-        curs_ = tf.placeholder(shape=xshape, dtype=tf.float32, name='input_current')
+            # the input can be shared by all the models
+            xshape.append(None)
+        curs_ = self._input(xshape, inputs)
+        initializer = self._batch_state(self._init_state, batch, init_state)
         res_ = tf.scan(self.step,
                        curs_,
-                       initializer=initializer.astype(np.float32))
+                       initializer=self._feedable_state(initializer))
+        self._final_state(res_[-1])
         return curs_, res_
 
-    def calculate(self, i):
+    def calculate(self, i, init_state=None, return_state=False):
         """
         Iterate over i (current) and return the state variables obtained after each step
 
         Args:
           i(ndarray): input current
+          init_state(ndarray): If not None, state to start from, e.g. the final state of a previous simulation
+            with the same batch (Default value = None, the initial state of the neuron)
+          return_state(bool): If True, also return the final state (Default value = False)
 
         Returns:
-            ndarray: state vectors concatenated [i.shape[0], len(self.init_state)(, i.shape[1]), self.num]
+            ndarray: state vectors concatenated [i.shape[0], len(self.init_state)(, i.shape[1]), self.num], and the
+            final state if `return_state`
         """
-        if i.ndim > 1:
-            input_cur, res_ = self.build_graph(batch=i.shape[1])
-        else:
-            input_cur, res_ = self.build_graph()
+        batch = i.shape[1] if i.ndim > 1 else None
         if i.ndim < 3 and self._num > 1:
-            i = np.stack([i for _ in range(self._num)], axis=i.ndim)
-        with tf.Session() as sess:
-            sess.run(tf.global_variables_initializer())
-            results = sess.run(res_, feed_dict={
-                input_cur: i
-            })
-        return results
+            i = i[..., None]
+        state = None if init_state is None else [init_state]
+        res = self.simulator(batch).run(i, state=state, return_state=return_state)
+        if return_state:
+            return res[0], res[1][0]
+        return res
+
+    def _feed_values(self, params):
+        if self._groups is None:
+            return params
+        # neurons of a group share the same values
+        return {var: np.asarray(val)[self._groups] for var, val in params.items()}
 
     def settings(self):
         """
@@ -278,6 +298,10 @@ class BioNeuronTf(MODEL, NeuronTf):
         """
         session.run(self._constraints)
 
+    def constraint_ops(self):
+        # read in the current context, e.g. after the training step the ops depend on
+        return [tf.assign(v, tf.clip_by_value(v.read_value(), con[0], con[1])) for v, con in self._clips]
+
     @property
     def variables(self):
         """Current variables of the models"""
@@ -329,11 +353,16 @@ class NeuronLSTM(NeuronTf):
     def predump(self, sess):
         self.vars_init = {v.name: sess.run(v) for v in tf.trainable_variables()}
 
+    def _initial_state(self, shape):
+        # the runs start from the hidden state of the networks
+        return None
+
     def __getstate__(self):
         state = self.__dict__.copy()
         del state['_ca_net']
         del state['_volt_net']
         del state['_hidden_init_state']
+        state.pop('_simulators', None)
         return state
 
     def __setstate__(self, state):
@@ -341,6 +370,7 @@ class NeuronLSTM(NeuronTf):
         self._volt_net = None
         self._ca_net = None
         self._hidden_init_state = None
+        self._simulators = {}
 
     def reset(self):
         num_units1 = [self._hidden_layer_size for _ in range(self._hidden_layer_nb)]
@@ -365,23 +395,27 @@ class NeuronLSTM(NeuronTf):
                 init_castate = self._ca_net.zero_state(batch, dtype=tf.float32)
             self._hidden_init_state = (init_vstate, init_castate)
 
-    def build_graph(self, batch=1):
+    def build_graph(self, batch=1, init_state=None, inputs=None):
+        if init_state is not None:
+            raise ValueError('The LSTM has no physical state to start from')
         tf.reset_default_graph()
         self.reset()
         xshape = [None, None]
 
-        curs_ = tf.placeholder(shape=xshape, dtype=tf.float32, name='input_current')
+        curs_ = self._input(xshape, inputs)
         with tf.variable_scope('prelayer'):
             input = tf.expand_dims(curs_ / self._max_cur, axis=len(xshape))
 
         with tf.variable_scope(self.id+'Volt'):
-            initializer = self._volt_net.zero_state(batch, dtype=tf.float32)
-            v_outputs, _ = tf.nn.dynamic_rnn(self._volt_net, inputs=input, initial_state=initializer, time_major=True)
+            initializer = self._feedable_state(self._volt_net.zero_state(batch, dtype=tf.float32))
+            v_outputs, v_final = tf.nn.dynamic_rnn(self._volt_net, inputs=input, initial_state=initializer, time_major=True)
+            self._final_state(v_final)
 
         if self._ca_net:
             with tf.variable_scope(self.id+'Calc'):
-                initializer = self._ca_net.zero_state(batch, dtype=tf.float32)
-                ca_outputs, _ = tf.nn.dynamic_rnn(self._ca_net, inputs=v_outputs, initial_state=initializer, time_major=True)
+                initializer = self._feedable_state(self._ca_net.zero_state(batch, dtype=tf.float32))
+                ca_outputs, ca_final = tf.nn.dynamic_rnn(self._ca_net, inputs=v_outputs, initial_state=initializer, time_major=True)
+                self._final_state(ca_final)
         else:
             ca_outputs = v_outputs
 
@@ -425,28 +459,26 @@ class NeuronLSTM(NeuronTf):
 
         return tf.stack(out), (vstate, castate)
 
-    def calculate(self, i):
+    def calculate(self, i, init_state=None, return_state=False):
         """
         Iterate over i (current) and return the state variables obtained after each step
 
         Args:
           i(ndarray): input current
+          init_state(list of ndarray): If not None, hidden state of the LSTM networks to start from, as returned
+            with `return_state` (Default value = None, the zero state)
+          return_state(bool): If True, also return the final hidden state (Default value = False)
 
         Returns:
-            ndarray: state vectors concatenated [i.shape[0], len(self.init_state)(, i.shape[1]), self.num]
+            ndarray: state vectors concatenated [i.shape[0], len(self.init_state)(, i.shape[1]), self.num], and the
+            final hidden state as a list of the flattened LSTM states if `return_state`
         """
         if i.ndim > 1:
-            input_cur, res_ = self.build_graph(batch=i.shape[1])
+            batch = i.shape[1]
         else:
-            input_cur, res_ = self.build_graph()
+            batch = 1
             i = i[:, None]
-        with tf.Session() as sess:
-            sess.run(tf.global_variables_initializer())
-            self.apply_init(sess)
-            results = sess.run(res_, feed_dict={
-                input_cur: i
-            })
-        return results
+        return self.simulator(batch).run(i, state=init_state, return_state=return_state)
 
     def settings(self):
         """
@@ -499,15 +531,20 @@ class Neurons(NeuronTf):
         for n in self._neurons:
             n.predump(sess)
 
+    def _structure(self):
+        return NeuronTf._structure(self) + tuple(n._structure() for n in self._neurons)
+
     def __getstate__(self):
         state = self.__dict__.copy()
         state['neurons'] = [n.__getstate__().copy() for n in self._neurons]
         for n in state['neurons']:
             pass
+        state.pop('_simulators', None)
         return state
 
     def __setstate__(self, state):
         self.__dict__.update(state)
+        self._simulators = {}
         for i, n in enumerate(self._neurons):
             n.__setstate__(state['neurons'][i])
 
@@ -587,6 +624,9 @@ class Neurons(NeuronTf):
         """
         return [n.apply_constraints(session) for n in self._neurons]
 
+    def constraint_ops(self):
+        return [op for n in self._neurons for op in n.constraint_ops()]
+
     def apply_init(self, session):
         [n.apply_init(session) for n in self._neurons]
 
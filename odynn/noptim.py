@@ -5,11 +5,11 @@
 .. moduleauthor:: Marc Javin
 """
 
-import tensorflow as tf
 import numpy as np
 
 from .neuron import BioNeuronTf, NeuronTf
 from .optim import Optimizer
+from .utils import tf
 
 
 class NeuronOpt(Optimizer):
@@ -47,21 +47,26 @@ class NeuronOpt(Optimizer):
                 ionc = res[..., pos, :]
                 losses += w[pos] * tf.square(tf.subtract(ionc, ys_[pos]))
             # losses = tf.nn.moments(losses, axes=[-1])[1] + tf.reduce_mean(losses, axis=[-1])
-        self._loss = tf.reduce_mean(losses, axis=[-2, -1])
+        self._loss = self._masked_mean(losses, [-2, -1], -1)
         # print(self.loss)
         # self.loss = self.loss[tf.random_uniform([1], 0, self.n_batch, dtype=tf.int32)[0]]  # tf.reduce_mean(losses, axis=[0, 1])
 
-    def plot_out(self, X, results, res_targ, suffix, step, name, i):
-        for b in range(self.n_batch):
-            res_t = [res_targ[i][:, b] if res_targ[i] is not None else None for i in range(len(res_targ))]
-            self.neuron.plot_output(self.neuron.dt*np.arange(len(X)), X[:, b], results[:, :, b], res_t,
-                                    suffix='%s_%s%s_%s_%s' % (suffix, name, b, step, i + 1), show=False,
-                                    save=True, l=0.7, lt=2)
+    def _set_measured(self, state, ys, t):
+        for pos in [self.neuron.V_pos] + list(self.neuron.ions.values()):
+            if ys[pos] is not None:
+                # [state, batch(, model)], measurements shared by all models
+                y = ys[pos][t]
+                state[pos] = y.reshape(y.shape + (1,) * (state[pos].ndim - y.ndim))
 
+    def plot_out(self, X, results, res_targ, suffix, step, name, i):
+        plot_traces(self.neuron, self.n_batch, X, results, res_targ, suffix, step, name, i)
 
+    def _plot_job(self):
+        return plot_traces, (self.neuron, self.n_batch)
 
     def optimize(self, dir, train, test=None, w=(1, 0), epochs=700, l_rate=(0.1, 9, 0.92), suffix='', step=None,
-                 reload=False, reload_dir=None, evol_var=True, plot=True):
+                 reload=False, reload_dir=None, evol_var=True, plot=True, window=None, shooting=None, w_shooting=1.,
+                 checkpoint=None, batch_size=None, shuffle=True, pipeline=False):
         """Optimize the neuron parameters
 
         Args:
@@ -80,6 +85,22 @@ class NeuronOpt(Optimizer):
           step:  (Default value = None)
           reload(bool): If True, will reload the graph saved in reload_dir (Default value = False)
           reload_dir(str): The path to the directory of the experience to reload (Default value = None)
+          window(int): If not None, number of time steps of the windows the traces are split in. The parameters
+            are updated after each window, and the final state of a window starts the next one without
+            backpropagating through it (Default value = None)
+          shooting(int): If not None, number of segments the traces are split in for multiple shooting. The segments
+            are simulated in parallel along the batch axis, from trainable start states initialised with the
+            measurements. Exclusive with window (Default value = None)
+          w_shooting(float): weight of the continuity penalty between segments (Default value = 1.)
+          checkpoint(int): If not None, number of time steps of the chunks whose activations are kept in memory
+            at once. The chunks are run again from stored states to compute the gradients, and the parameters are
+            updated once per epoch. Exclusive with window and shooting (Default value = None)
+          batch_size(int): If not None, number of elements of the batch used for each update. An epoch runs over
+            all the minibatches (Default value = None)
+          shuffle(bool): If True, draw the minibatches in a random order at each epoch (Default value = True)
+          pipeline(bool): If True, keep the training data in the session and feed the runs with a prefetching input
+            pipeline, without copying the current for each parallel model. Not compatible with the checkpointed and
+            multiple shooting modes (Default value = False)
 
         Returns:
             :obj:`NeuronTf`: neuron attribute after optimization
@@ -89,5 +110,27 @@ class NeuronOpt(Optimizer):
             return
         yshape = [None, None]
         Optimizer.optimize(self, dir, train, test, w, epochs, l_rate, suffix, step, reload, reload_dir, yshape=yshape,
-                           evol_var=evol_var, plot=plot)
-
+                           evol_var=evol_var, plot=plot, window=window, shooting=shooting, w_shooting=w_shooting,
+                           checkpoint=checkpoint, batch_size=batch_size, shuffle=shuffle,
+                           pipeline=pipeline)
+
+
+def plot_traces(neuron, n_batch, X, results, res_targ, suffix, step, name, i):
+    """Plot the traces of each element of the batch against the targets
+
+    Args:
+        neuron(NeuronTf): optimized neuron
+        n_batch(int): dimension of the batch
+        X(ndarray): input current
+        results(ndarray): states of the neuron, [time, state, batch(, model)]
+        res_targ(list): measurements, as in the training data
+        suffix(str): suffix of the optimization
+        step(str): step of the optimization
+        name(str): name of the data, e.g. 'train'
+        i(int): epoch
+    """
+    for b in range(n_batch):
+        res_t = [res_targ[i][:, b] if res_targ[i] is not None else None for i in range(len(res_targ))]
+        neuron.plot_output(neuron.dt*np.arange(len(X)), X[:, b], results[:, :, b], res_t,
+                           suffix='%s_%s%s_%s_%s' % (suffix, name, b, step, i + 1), show=False,
+                           save=True, l=0.7, lt=2)
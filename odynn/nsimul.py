@@ -6,15 +6,21 @@
 """
 
 from .neuron import PyBioNeuron
+from . import parallel
+from collections import deque
+import itertools
+import multiprocessing
 import time
 import numpy as np
-import scipy as sp
 
 DT = 0.1
 t_len = 5000.
-t = np.array(sp.arange(0.0, t_len, DT))
+t = np.array(np.arange(0.0, t_len, DT))
 i_inj = 10. * ((t > 100) & (t < 750)) + 20. * ((t > 1500) & (t < 2500)) + 40. * ((t > 3000) & (t < 4000))
 
+SWEEP_MEMORY = 2 ** 26
+"""int, default size in bytes of the state buffer of a chunk of parameter sets in `sweep`"""
+
 
 def comp_pars(ps, t=None, dt=DT, i_inj=i_inj, suffix='', show=True, save=False):
     """Compare different parameter sets on the same experiment
@@ -31,12 +37,91 @@ def comp_pars(ps, t=None, dt=DT, i_inj=i_inj, suffix='', show=True, save=False):
     if t is not None:
         dt = t[1] - t[0]
     else:
-        t = sp.arange(0, len(i_inj) * dt, dt)
+        t = np.arange(0, len(i_inj) * dt, dt)
     neurons = PyBioNeuron(init_p=ps, dt=dt)
     X = neurons.calculate(i_inj)
     print("Simulation time : ", time.time() - start)
     neurons.plot_output(t, i_inj, X, suffix=suffix, show=show, save=save)
 
+def _simul_chunk(chunk, dt, i_inj, out, record=None, every=1):
+    """Simulate a chunk of parameter sets in `out` of shape [time, state, (batch,) chunk]"""
+    if len(chunk) == 1:
+        # a single parameter set has no neuron axis, its values are cast as in the vectorised neurons
+        p = {var: np.float32(val) for var, val in chunk[0].items()}
+        PyBioNeuron(p, dt=dt).calculate(i_inj[..., 0] if i_inj.ndim > 1 else i_inj, out=out[..., 0],
+                                         record=record, every=every)
+    else:
+        PyBioNeuron(chunk, dt=dt).calculate(i_inj, out=out, record=record, every=every)
+    return out
+
+
+def _sweep_chunk(chunk, dt, slot, record, every):
+    """Simulate a chunk of parameter sets in a worker, in a slot of the shared buffer"""
+    _simul_chunk(chunk, dt, parallel.get('i_inj'), parallel.get('out')[slot, ..., :len(chunk)], record, every)
+
+
+def sweep(ps, dt=DT, i_inj=i_inj, features=None, memory=SWEEP_MEMORY, workers=0, record=None, every=1):
+    """Simulate a large number of parameter sets on the same experiment.
+    The parameter sets are read by chunks, each simulated at once as a vectorised neuron, with as many sets as fit
+    in `memory`. The state buffers are allocated once and reused by all the chunks.
+    With workers, the chunks are simulated in a pool of processes, in shared buffers holding two chunks per worker.
+    They are yielded in the order of the parameter sets.
+
+    Args:
+      ps(iterable of dict): parameter sets, e.g. a list or a generator of `PyBioNeuron.get_random()` draws
+      dt(float): time step
+      i_inj(ndarray): input currents of shape [time, (batch)]
+      features(callable): If not None, summary of the states of a chunk, mapping an array of shape
+        [time, state, (batch,) chunk] to an array whose last axis is the chunk (Default value = None)
+      memory(int): size in bytes of the state buffer of a chunk (Default value = SWEEP_MEMORY)
+      workers(int): number of processes, 0 to simulate in this process and None for one per
+        processor (Default value = 0)
+      record(list of int): If not None, positions of the state variables to record (Default value = None)
+      every(int): record the state every `every` time steps, fewer recorded states making larger
+        chunks (Default value = 1)
+
+    Yields:
+        tuple: the list of the parameter sets of a chunk, and their features if `features` is given, else their
+        states of shape [time, state, (batch,) chunk]. The states are overwritten by a next chunk, they have to be
+        copied to be kept.
+    """
+    i_inj = np.asarray(i_inj)
+    if i_inj.ndim > 1:
+        # the parameter sets are along the last axis
+        i_inj = i_inj[..., None]
+    shape = (len(range(0, len(i_inj), every)),
+             len(PyBioNeuron.default_init_state) if record is None else len(record)) + i_inj.shape[1:-1]
+    dtype = np.result_type(np.asarray(PyBioNeuron.default_init_state), i_inj)
+    size = max(1, int(memory // (np.prod(shape) * dtype.itemsize)))
+    ps = iter(ps)
+    if workers == 0:
+        out = None
+        for chunk in iter(lambda: list(itertools.islice(ps, size)), []):
+            if out is None:
+                out = np.empty(shape + (len(chunk),), dtype=dtype)
+            X = _simul_chunk(chunk, dt, i_inj, out[..., :len(chunk)], record, every)
+            yield chunk, (X if features is None else features(X))
+        return
+    n_slots = 2 * (workers or multiprocessing.cpu_count())
+    with parallel.SharedPool(workers, i_inj=parallel.SharedArray.copy(i_inj),
+                             out=parallel.SharedArray((n_slots,) + shape + (size,), dtype)) as pool:
+        out = pool.arrays['out']
+        free = list(range(n_slots))
+        pending = deque()
+        chunks = iter(lambda: list(itertools.islice(ps, size)), [])
+        while True:
+            for slot, chunk in zip(list(free), chunks):
+                free.remove(slot)
+                pending.append((chunk, slot, pool.apply_async(_sweep_chunk, (chunk, dt, slot, record, every))))
+            if not pending:
+                return
+            chunk, slot, res = pending.popleft()
+            res.get()
+            X = out[slot, ..., :len(chunk)]
+            yield chunk, (X if features is None else features(X))
+            free.append(slot)
+
+
 def comp_pars_targ(p, p_targ, t=None, dt=DT, i_inj=i_inj, suffix='', save=False, show=True):
     """Compare parameter sets with a target
 
@@ -57,7 +142,7 @@ def comp_pars_targ(p, p_targ, t=None, dt=DT, i_inj=i_inj, suffix='', save=False,
     if t is not None:
         dt = t[1] - t[0]
     else:
-        t = sp.arange(0, len(i_inj) * dt, dt)
+        t = np.arange(0, len(i_inj) * dt, dt)
 
     start = time.time()
     neurons = PyBioNeuron(init_p=p, dt=dt)
@@ -82,7 +167,7 @@ def comp_neurons(neurons, i_inj=i_inj, suffix='', show=True, save=False):
         X.append(n.calculate(i_inj))
     X = np.stack(X, axis=2)
     print("Simulation time : ", time.time() - start)
-    t = sp.arange(0, len(i_inj)*neurons[0].dt, neurons[0].dt)
+    t = np.arange(0, len(i_inj)*neurons[0].dt, neurons[0].dt)
     neurons[0].plot_output(t, i_inj, X, show=show, save=save)
 
 def comp_neuron_trace(neuron, trace, i_inj=i_inj, scale=False, suffix='', show=True, save=False):
@@ -105,7 +190,7 @@ def comp_neuron_trace(neuron, trace, i_inj=i_inj, scale=False, suffix='', show=T
         for i, t in enumerate(trace):
             if t is not None:
                 t *= np.max(X[:,i]) / np.max(t)
-    ts = sp.arange(0., len(i_inj)*neuron.dt, neuron.dt)
+    ts = np.arange(0., len(i_inj)*neuron.dt, neuron.dt)
     neuron.plot_output(ts, i_inj, X, trace, suffix=suffix, show=show, save=save)
 
 
@@ -131,7 +216,7 @@ def simul(p=None, neuron=None, t=None, dt=DT, i_inj=i_inj, suffix='', show=False
     if t is not None:
         dt = t[1] - t[0]
     else:
-        t = sp.arange(0, len(i_inj) * dt, dt)
+        t = np.arange(0, len(i_inj) * dt, dt)
     if(neuron is None):
         neuron = PyBioNeuron(p, dt=dt)
     print('Neuron Simulation'.center(40,'_'))
@@ -10,16 +10,19 @@ import time
 from abc import ABC, abstractmethod
 
 import numpy as np
-import tensorflow as tf
 import copy
-from tqdm import tqdm
 
-from .utils import OUT_SETTINGS, IMG_DIR
-from . import utils
-import pylab as plt
+from .utils import OUT_SETTINGS, IMG_DIR, plt, tf, LazyModule
+from . import utils, trainlog, plotter
+
+nest = LazyModule('tensorflow.python.util.nest')
+tqdm = LazyModule('tqdm')
 
 SAVE_PATH = utils.TMP_DIR + 'model.ckpt'
+CKPT_STATE = 'checkpoint'
 FILE_LV = utils.TMP_DIR + 'dump_lossratevars'
+LOG_DIR = utils.TMP_DIR + 'log'
+VARS_COL = 'vars/'
 FILE_OBJ = utils.TMP_DIR + 'optimized'
 TRAIN_FILE = utils.TMP_DIR + 'train'
 TEST_FILE = utils.TMP_DIR + 'test'
@@ -27,6 +30,11 @@ TEST_FILE = utils.TMP_DIR + 'test'
 INTRA_PAR = 4
 INTER_PAR = 1
 
+STATE_IN = 'initial_states'
+"""str, graph collection of the feedable initial states of a run"""
+STATE_OUT = 'final_states'
+"""str, graph collection of the final states of a run, in the same order as `STATE_IN`"""
+
 
 class Optimized(ABC):
     """Abstract class for object to be optimized. It could represent on or a set of neurons, or a circuit."""
@@ -39,6 +47,7 @@ class Optimized(ABC):
         self._init_p = {}
         self._param = {}
         self._constraints = {}
+        self._simulators = {}
 
     @property
     def num(self):
@@ -46,10 +55,34 @@ class Optimized(ABC):
         return self._num
 
     @abstractmethod
-    def build_graph(self, batch=1):
-        """Build the tensorflow graph. Take care of the loop and the initial state."""
+    def build_graph(self, batch=1, init_state=None, inputs=None):
+        """Build the tensorflow graph. Take care of the loop and the initial state.
+
+        Args:
+            batch(int): dimension of the batch
+            init_state(callable): if not None, function giving the tensor to start from, given the default
+                initial state of shape [state, batch, ...]
+            inputs(callable): if not None, function giving the input tensor to use instead of a placeholder
+        """
         pass
 
+    @staticmethod
+    def _input(xshape, inputs=None):
+        """Give the input tensor of the graph, a placeholder unless `inputs` provides one
+
+        Args:
+            xshape(list): expected shape of the input
+            inputs(callable): if not None, function giving the input tensor
+
+        Returns:
+            tf.Tensor: input of the graph
+        """
+        if inputs is None:
+            return tf.placeholder(shape=xshape, dtype=tf.float32, name='input_current')
+        curs_ = inputs()
+        curs_.set_shape(xshape)
+        return curs_
+
     @abstractmethod
     def settings(self):
         """
@@ -82,6 +115,15 @@ class Optimized(ABC):
         """
         pass
 
+    def constraint_ops(self):
+        """Build the ops projecting the optimized variables on their constraints, in the current graph context,
+        e.g. under control dependencies on a training step
+
+        Returns:
+            list of tf.Operation: projection ops
+        """
+        return []
+
     def apply_init(self, session):
         pass
 
@@ -105,6 +147,177 @@ class Optimized(ABC):
     def study_vars(self, p, *args, **kwargs):
         pass
 
+    @staticmethod
+    def _feedable_state(init):
+        """Make the initial state of a run feedable, to start it from any state.
+        The new placeholders are added to the `STATE_IN` collection.
+
+        Args:
+            init(ndarray, tf.Tensor or nested structure of them): initial state
+
+        Returns:
+            same structure as `init`, each element being a placeholder with the element as default
+        """
+        def feedable(x):
+            x = tf.convert_to_tensor(x, dtype=tf.float32)
+            x_ = tf.placeholder_with_default(x, shape=x.get_shape())
+            tf.add_to_collection(STATE_IN, x_)
+            return x_
+        return nest.map_structure(feedable, init)
+
+    @staticmethod
+    def _batch_state(init, batch=None, init_state=None):
+        """Give the initial state of a run, broadcast along the batch axis inside the graph instead of being copied
+        for each element of the batch
+
+        Args:
+            init(ndarray): initial state of shape [state, ...]
+            batch(int): dimension of the batch, None for no batch axis
+            init_state(callable): if not None, function giving the tensor to start from, given the default
+                initial state as a read-only array of shape [state, batch, ...]
+
+        Returns:
+            tf.Tensor: initial state of shape [state, batch, ...]
+        """
+        init = np.asarray(init, dtype=np.float32)
+        if batch is None:
+            shape = init.shape
+        else:
+            init = init[:, None]
+            shape = init.shape[:1] + (batch,) + init.shape[2:]
+        if init_state is not None:
+            return init_state(np.broadcast_to(init, shape))
+        return tf.tile(tf.constant(init), np.array(shape) // init.shape)
+
+    @staticmethod
+    def _final_state(final):
+        """Add the final state of a run to the `STATE_OUT` collection
+
+        Args:
+            final(tf.Tensor or nested structure of them): final state, with the structure of the initial one
+        """
+        for x in nest.flatten(final):
+            tf.add_to_collection(STATE_OUT, x)
+
+    def _feed_values(self, params):
+        """Give the values to feed to the tensors of `variables` for some parameters
+
+        Args:
+            params(dict): parameters, structured as `init_params`
+
+        Returns:
+            dict: values, with the same keys as `variables`
+        """
+        return params
+
+    def _structure(self):
+        """Give what the graph of the object is built from, apart from the values of the parameters and of the
+        initial state which are fed at each run. A simulator is built again when it changes
+
+        Returns:
+            tuple: hashable description of the structure
+        """
+        return (self.dt, np.shape(self.init_state),
+                tuple(sorted((var, np.shape(val)) for var, val in self.init_params.items())))
+
+    def _initial_state(self, shape):
+        """Give the current initial state, to feed as the first initial state of a run
+
+        Args:
+            shape(tuple): shape of the first initial state of the graph, [state, (batch,) ...]
+
+        Returns:
+            ndarray: initial state broadcast to `shape`, None if the graph does not start from `init_state`
+        """
+        init = np.asarray(self.init_state, dtype=np.float32)
+        if len(shape) > init.ndim:
+            init = init[:, None]
+        return np.broadcast_to(init, shape)
+
+    def simulator(self, batch=None):
+        """Give a compiled simulator of the object, built on first use and cached by input shape and structure
+
+        Args:
+            batch(int): dimension of the batch, None for the default of `build_graph`
+
+        Returns:
+            Simulator: simulator reusing its graph and session for every run
+        """
+        key = (batch, self._structure())
+        if key not in self._simulators:
+            self._simulators[key] = Simulator(self, batch)
+        return self._simulators[key]
+
+    def clear_simulators(self):
+        """Close the cached simulators, e.g. after a change of structure or time step"""
+        for sim in self._simulators.values():
+            sim.close()
+        self._simulators = {}
+
+
+class Simulator:
+    """Graph and session compiled once to simulate an `Optimized` object on several inputs and parameters"""
+
+    def __init__(self, optimized, batch=None):
+        """
+        Args:
+            optimized(Optimized): object to simulate
+            batch(int): dimension of the batch, None for the default of `build_graph`
+        """
+        self._optimized = optimized
+        if batch is None:
+            self._input, self._res = optimized.build_graph()
+        else:
+            self._input, self._res = optimized.build_graph(batch=batch)
+        self._graph = tf.get_default_graph()
+        self._state_in = tf.get_collection(STATE_IN)
+        self._state_out = tf.get_collection(STATE_OUT)
+        # keep the tensors of this graph, the object gets new ones at its next build
+        self._params = dict(optimized.variables)
+        self._vars = {v.name: v for v in tf.global_variables()}
+        self._sess = tf.Session(graph=self._graph)
+        self._sess.run(tf.global_variables_initializer())
+        optimized.apply_init(self._sess)
+
+    def run(self, i, params=None, state=None, return_state=False):
+        """Simulate the object with the input current i
+
+        Args:
+            i(ndarray): input current, shaped as the input placeholder of `build_graph`
+            params(dict): parameters of the simulation, structured as `init_params`
+                (Default value = None, the current `init_params` of the object)
+            state(list of ndarray): If not None, state to start from, flattened as the final state returned with
+                `return_state` (Default value = None, the initial state of the object)
+            return_state(bool): If True, also return the final state (Default value = False)
+
+        Returns:
+            ndarray: results of the simulation, and the final state as a list of ndarray if `return_state`
+        """
+        if params is None:
+            params = self._optimized.init_params
+        feed_dict = {self._input: i}
+        for var, val in self._optimized._feed_values(params).items():
+            if var in self._params:
+                feed_dict[self._params[var]] = val
+            elif var in self._vars:
+                # variables not exposed as parameters, e.g. weights of a network
+                self._vars[var].load(val, self._sess)
+        if state is not None:
+            feed_dict.update(zip(self._state_in, state))
+        elif self._state_in:
+            # the initial state of the object can change after the graph is built
+            init = self._optimized._initial_state(tuple(self._state_in[0].get_shape().as_list()))
+            if init is not None:
+                feed_dict[self._state_in[0]] = init
+        if return_state:
+            res, final = self._sess.run([self._res, self._state_out], feed_dict=feed_dict)
+            return res, final
+        return self._sess.run(self._res, feed_dict=feed_dict)
+
+    def close(self):
+        """Release the session"""
+        self._sess.close()
+
 
 class Optimizer(ABC):
 
@@ -122,8 +335,34 @@ class Optimizer(ABC):
         self.dir = None
         self._loss = None
         self.freq_test = 30
+        # epochs between two snapshots of the variables, whose records are NaN in between, and between two
+        # tensorboard summaries
+        self.freq_vars = 1
+        self.freq_summary = 1
+        # saved files, checkpoints and plots are written in the background, with at most `writer_queue` pending
+        # snapshots, and `keep_snapshots` previous versions of the saved files and checkpoints are kept
+        self.writer_queue = 8
+        self.keep_snapshots = 0
+        # plots are rendered by `plot_processes` worker processes, at most once every `plot_interval` seconds
+        # for each kind of plot, only the latest one being rendered
+        self.plot_processes = 1
+        self.plot_interval = 0.
         self._test_losses = None
         self._test = False
+        self._state_in = []
+        self._state_out = []
+        self._shooting = None
+        self._shoot_default = None
+        self._shoot_starts = None
+        self._test_starts = None
+        self._checkpoint = None
+        self._batch_size = None
+        self._pipeline = False
+        self._iterator = None
+        self._data_feed = None
+        self._epoch_fetches = {}
+        self._batch_mask = None
+        self._batch_feed = {}
 
     def _init_l_rate(self):
         global_step = tf.Variable(0, trainable=False)
@@ -143,25 +382,62 @@ class Optimizer(ABC):
         # self.learning_rate = 0.1
         opt = tf.train.AdamOptimizer(learning_rate=self.learning_rate)
 
-        gvs = opt.compute_gradients(self._loss)
-        gvs = [(g,v) for g,v in gvs if g is not None]
-        grads, vars = zip(*gvs)
+        if self._checkpoint is None:
+            gvs = opt.compute_gradients(self._loss)
+            gvs = [(g,v) for g,v in gvs if g is not None]
+            grads, vars = zip(*gvs)
+        else:
+            grads, vars = self._build_chunk_grads()
 
         if self._parallel > 1:
-            grads_normed = []
-            for i in range(self._parallel):
-                # clip by norm for each parallel model (neuron or circuit)
-                gi = [g[..., i] for g in grads]
-                # gi = [tf.where(tf.is_nan(g), tf.zeros_like(g), g) for g in gi]
-                gi_norm, _ = tf.clip_by_global_norm(gi, 5.)
-                grads_normed.append(gi_norm)
-            grads_normed = [tf.stack([grads_normed[i][j] for i in range(self._parallel)], axis=-1) for j in range(len(grads))]
+            # clip by global norm for each parallel model (neuron or circuit), the model being the last axis
+            flat = tf.concat([tf.reshape(g, [-1, self._parallel]) for g in grads], axis=0)
+            norms = tf.sqrt(tf.reduce_sum(tf.square(flat), axis=0))
+            scale = 5. / tf.maximum(norms, 5.)
+            grads_normed = [g * scale for g in grads]
         else:
             grads_normed, _ = tf.clip_by_global_norm(grads, 5.)
-        self.train_op = opt.apply_gradients(zip(grads_normed, vars), global_step=global_step)
+        # the rate of the step is computed before the step increments global_step
+        with tf.control_dependencies([self.learning_rate]):
+            apply = opt.apply_gradients(zip(grads_normed, vars), global_step=global_step)
+        # project on the constraints in the same run, once the update is applied
+        with tf.control_dependencies([apply]):
+            self.train_op = tf.group(*self.optimized.constraint_ops())
         # tf.summary.histogram(name='gradients', values=gvs)
 
-        self.saver = tf.train.Saver()
+        variables = tf.global_variables()
+        self.saver = tf.train.Saver(variables)
+        # the checkpoints are written in the background from a copy of the variables, made in the training thread,
+        # and the `keep_snapshots` previous ones are kept
+        with tf.variable_scope('snapshot'):
+            copies = [tf.Variable(tf.zeros(v.get_shape(), v.dtype.base_dtype), trainable=False, name=v.op.name)
+                      for v in variables]
+        self._snapshot_op = tf.group(*[tf.assign(c, v) for c, v in zip(copies, variables)])
+        self._snapshot_saver = tf.train.Saver({v.op.name: c for v, c in zip(variables, copies)},
+                                              max_to_keep=self.keep_snapshots + 1, save_relative_paths=True)
+
+    def _build_chunk_grads(self):
+        """Gradients of one chunk of the traces, for the checkpointed training.
+        The objective of a chunk is its share of the loss plus the effect of its final state on the next chunks,
+        given by the adjoints of this state. Its gradient with respect to the initial state gives the adjoints
+        for the previous chunk.
+
+        Returns:
+            list of tf.placeholder, list of tf.Variable: placeholders for the gradients accumulated over all chunks,
+            and the corresponding variables
+        """
+        self._loss_scale = tf.placeholder_with_default(1., shape=(), name='loss_scale')
+        self._adjoints = [tf.placeholder_with_default(tf.zeros_like(s), shape=s.get_shape()) for s in self._state_out]
+        objective = tf.reduce_sum(self._loss) * self._loss_scale
+        for a, s in zip(self._adjoints, self._state_out):
+            objective += tf.reduce_sum(a * s)
+        vars = tf.trainable_variables()
+        grads = tf.gradients(objective, vars + self._state_in)
+        gvs = [(tf.convert_to_tensor(g), v) for g, v in zip(grads, vars) if g is not None]
+        self._chunk_grads = [g for g, _ in gvs]
+        self._state_grads = [g if g is not None else tf.zeros_like(s) for g, s in zip(grads[len(vars):], self._state_in)]
+        self._acc_grads = [tf.placeholder(tf.float32, shape=v.get_shape()) for _, v in gvs]
+        return self._acc_grads, [v for _, v in gvs]
 
     def _init(self, dir, suffix, train, test, l_rate, w, yshape):
         """Initialize directory and the object to be optimized, get the dataset, write settings in the directory
@@ -205,15 +481,34 @@ class Optimizer(ABC):
             pickle.dump(test, f)
 
         if self._parallel > 1:
-            # add dimension to current for neurons trained in parallel
-            train[1] = np.stack([train[1] for _ in range(self._parallel)], axis=-1)
+            # add a dimension to the current for neurons trained in parallel, broadcast in the graph
+            if not self._pipeline:
+                train[1] = train[1][..., None]
 
             if self._test:
-                test[1] = np.stack([test[1] for _ in range(self._parallel)], axis=-1)
+                test[1] = test[1][..., None]
 
-        xs_, res = self.optimized.build_graph(batch=self.n_batch)
-        ys_ = [tf.placeholder(shape=yshape, dtype=tf.float32, name="Measure_out_%s"%i) if t is not None
-                    else 0. for i,t in enumerate(train[-1])]
+        if self._shooting is None:
+            inputs = self._pipeline_inputs(train) if self._pipeline else None
+            xs_, res = self.optimized.build_graph(batch=self._batch_size or self.n_batch, inputs=inputs)
+        else:
+            for data in [train] + ([test] if test is not None else []):
+                if len(data[1]) % self._shooting != 0:
+                    raise ValueError('The number of time steps ({}) should be divisible by the number of segments ({})'
+                                     .format(len(data[1]), self._shooting))
+            xs_, res = self.optimized.build_graph(batch=self.n_batch * self._shooting,
+                                                  init_state=self._shooting_init(train[-1]))
+            train = self._segment_data(train)
+            if test is not None:
+                self._test_starts = self._shooting_starts(test[-1])
+                test = self._segment_data(test)
+        self._state_in = tf.get_collection(STATE_IN)
+        self._state_out = tf.get_collection(STATE_OUT)
+        if self._pipeline:
+            ys_ = self._pipeline_measures(train[-1])
+        else:
+            ys_ = [tf.placeholder(shape=yshape, dtype=tf.float32, name="Measure_out_%s"%i) if t is not None
+                        else 0. for i,t in enumerate(train[-1])]
 
         print("i expected : ", xs_.shape)
         print("i : ", train[1].shape)
@@ -248,15 +543,441 @@ class Optimizer(ABC):
     def plot_out(self, *args, **kwargs):
         pass
 
+    def _plot_job(self):
+        """Give the picklable function doing `plot_out` in a worker process, and its first arguments
+
+        Returns:
+            callable, tuple: function and arguments preceding the ones of `plot_out`
+        """
+        return self.plot_out, ()
+
     @abstractmethod
     def _build_loss(self, res, ys_, w):
         pass
 
+    def _masked_mean(self, losses, axis, batch_axis):
+        """Average the losses, leaving out the elements of the batch masked by `_batch_mask`, like the padding
+        completing the last minibatch
+
+        Args:
+            losses(tf.Tensor): losses of each element
+            axis(list of int): axes to average, including `batch_axis`
+            batch_axis(int): batch axis of `losses`
+
+        Returns:
+            tf.Tensor: average of the losses of the elements that are not masked
+        """
+        n = tf.shape(losses)[batch_axis]
+        self._batch_mask = tf.placeholder_with_default(tf.ones([n]), shape=[None], name='batch_mask')
+        shape = [1] * losses.get_shape().ndims
+        shape[batch_axis] = -1
+        mask = tf.reshape(self._batch_mask, shape)
+        return tf.reduce_mean(losses * mask, axis=axis) * tf.cast(n, tf.float32) / tf.reduce_sum(self._batch_mask)
+
+    def _set_measured(self, state, ys, t):
+        """Set the measured variables of some states to their measurements
+
+        Args:
+            state(ndarray): states of shape [state, batch, ...], modified in place
+            ys(list): measurements, as in the training data
+            t(int): time index of the measurements
+        """
+        pass
+
+    def _shooting_starts(self, ys):
+        """Give the start states of the segments in multiple shooting, initialised from the measurements
+
+        Args:
+            ys(list): measurements, as in the training data
+
+        Returns:
+            ndarray: start states of shape [state, segment * batch, ...]
+        """
+        starts = np.array(self._shoot_default)
+        t = len([y for y in ys if y is not None][0]) // self._shooting
+        for k in range(1, self._shooting):
+            # the first state of a segment is recorded after one step, its start is the previous measurement
+            self._set_measured(starts[:, k * self.n_batch:(k + 1) * self.n_batch], ys, k * t - 1)
+        return starts
+
+    def _shooting_init(self, ys):
+        """Give the function defining the start states of the segments for `build_graph`.
+        The first segment starts from the initial state, the others from trainable states.
+
+        Args:
+            ys(list): measurements of the training data, to initialise the start states
+
+        Returns:
+            callable: function of the default initial state, giving the start states
+        """
+        def init_state(default):
+            self._shoot_default = default
+            starts = self._shooting_starts(ys).astype(np.float32)
+            free = tf.get_variable('shooting_states', initializer=starts[:, self.n_batch:])
+            self._shoot_starts = tf.concat([tf.constant(starts[:, :self.n_batch]), free], axis=1)
+            return self._shoot_starts
+        return init_state
+
+    def _segment_data(self, data):
+        """Split the traces in segments laid along the batch axis
+
+        Args:
+            data(list): [time, input, measurements], each trace of shape [time, batch, ...]
+
+        Returns:
+            list: same structure, each trace of shape [time / segment, segment * batch, ...]
+        """
+        def segment(x):
+            k = self._shooting
+            x = np.swapaxes(x.reshape((k, len(x) // k) + x.shape[1:]), 0, 1)
+            return x.reshape((x.shape[0], k * x.shape[2]) + x.shape[3:])
+        return [data[0], segment(data[1]), [segment(y) if y is not None else None for y in data[-1]]]
+
+    def _unsegment(self, res):
+        """Put back segmented results in time order
+
+        Args:
+            res(ndarray): results of shape [time / segment, state, segment * batch, ...]
+
+        Returns:
+            ndarray: results of shape [time, state, batch, ...]
+        """
+        if self._shooting is None:
+            return res
+        k = self._shooting
+        res = np.moveaxis(res.reshape(res.shape[:2] + (k, res.shape[2] // k) + res.shape[3:]), 2, 0)
+        return res.reshape((-1,) + res.shape[2:])
+
+    def _continuity_loss(self, res):
+        """Penalty on the gap between the end of each segment and the start of the next one.
+        The starts are the ones the run is fed with, the trainable ones for training and the ones from the
+        measurements for testing
+
+        Args:
+            res(tf.Tensor): results of shape [time, state, segment * batch, ...]
+
+        Returns:
+            tf.Tensor: penalty, for each model if trained in parallel
+        """
+        gap = res[-1][:, :-self.n_batch] - self._state_in[0][:, self.n_batch:]
+        axis = list(range(gap.get_shape().ndims))
+        if self._parallel > 1:
+            axis = axis[:-1]
+        return tf.reduce_mean(tf.square(gap), axis=axis)
+
+    @staticmethod
+    def _windows(length, window=None):
+        """Split the time axis in windows
+
+        Args:
+            length(int): number of time steps
+            window(int): number of time steps per window, None for a single window (Default value = None)
+
+        Returns:
+            list of slice: consecutive windows covering the time axis
+
+        Raises:
+            ValueError: if window is not a positive integer
+        """
+        if window is None:
+            return [slice(None)]
+        if int(window) != window or window < 1:
+            raise ValueError('The window should be a positive number of time steps, got {}'.format(window))
+        window = int(window)
+        return [slice(t, t + window) for t in range(0, length, window)]
+
+    @staticmethod
+    def _minibatches(n, size=None, shuffle=False):
+        """Split the batch axis in minibatches
+
+        Args:
+            n(int): number of elements in the batch
+            size(int): number of elements per minibatch, None for a single minibatch with all of them
+                (Default value = None)
+            shuffle(bool): If True, draw the elements in a random order (Default value = False)
+
+        Returns:
+            ndarray: indices of the elements in each minibatch, of shape [minibatch, size]. If size does not divide n,
+            the last minibatch is completed with the first elements
+
+        Raises:
+            ValueError: if size is not an integer between 1 and n
+        """
+        idx = np.random.permutation(n) if shuffle else np.arange(n)
+        if size is None:
+            return idx[None]
+        if int(size) != size or not 1 <= size <= n:
+            raise ValueError('The size of the minibatches should be an integer between 1 and {}, got {}'.format(n, size))
+        size = int(size)
+        return np.resize(idx, (-(-n // size), size))
+
+    @staticmethod
+    def _minibatch_mask(batches, n):
+        """Give the mask of the elements of the minibatches that are not padding, so that each element counts
+        once per epoch
+
+        Args:
+            batches(ndarray): minibatches given by `_minibatches`
+            n(int): number of elements in the batch
+
+        Returns:
+            ndarray: 1 for the elements to count and 0 for the padding, of the shape of `batches`
+        """
+        return (np.arange(batches.size) < n).reshape(batches.shape).astype(np.float32)
+
+    @staticmethod
+    def _take(data, idx):
+        """Select elements of the batch axis
+
+        Args:
+            data(list): [time, input, measurements], each trace of shape [time, batch, ...]
+            idx(ndarray): indices of the elements to select
+
+        Returns:
+            list: same structure, each trace of shape [time, len(idx), ...]
+        """
+        return [data[0], data[1][:, idx], [y[:, idx] if y is not None else None for y in data[-1]]]
+
+    def _pipeline_inputs(self, train):
+        """Give the function building the input pipeline, to be called by `build_graph`.
+        The training data is loaded once in the session, without the dimension of the parallel models, and each
+        run takes the next element of a dataset gathering a minibatch and a window of it, prepared while the previous
+        run is going on.
+
+        Args:
+            train(list): training data
+
+        Returns:
+            callable: function giving the input tensor
+        """
+        size = self._batch_size or self.n_batch
+
+        def inputs():
+            data = [train[1]] + [y for y in train[-1] if y is not None]
+            data_ = [tf.placeholder(shape=d.shape, dtype=tf.float32) for d in data]
+            self._data_feed = dict(zip(data_, data))
+            resident = [tf.Variable(d_, trainable=False, collections=[tf.GraphKeys.LOCAL_VARIABLES],
+                                    name='train_data') for d_ in data_]
+            self._pipe_batches = tf.placeholder(shape=[None, size], dtype=tf.int32, name='pipeline_batches')
+            self._pipe_starts = tf.placeholder(shape=[None], dtype=tf.int32, name='pipeline_starts')
+            self._pipe_stops = tf.placeholder(shape=[None], dtype=tf.int32, name='pipeline_stops')
+
+            def element(idx, start, stop):
+                elem = [tf.gather(d[start:stop], idx, axis=1) for d in resident]
+                if self._parallel > 1:
+                    elem[0] = elem[0][..., None]
+                return tuple(elem)
+
+            dataset = tf.data.Dataset.from_tensor_slices((self._pipe_batches, self._pipe_starts, self._pipe_stops))
+            dataset = dataset.map(element).prefetch(1)
+            self._iterator = dataset.make_initializable_iterator()
+            self._pipe_next = self._iterator.get_next()
+            return self._pipe_next[0]
+
+        return inputs
+
+    def _pipeline_measures(self, ys):
+        """Give the measurements coming out of the input pipeline, 0. for the missing ones"""
+        measures = iter(self._pipe_next[1:])
+        return [next(measures) if y is not None else 0. for y in ys]
+
+    def _start_pipeline(self, sess, batches, windows, length):
+        """Initialize the input pipeline for one epoch, going through the windows of each minibatch in order
+
+        Args:
+            sess(tf.Session): session
+            batches(ndarray): indices of the elements in each minibatch
+            windows(list of slice): windows on the time axis
+            length(int): number of time steps
+        """
+        bounds = [w.indices(length)[:2] for w in windows]
+        starts, stops = zip(*(bounds * len(batches)))
+        sess.run(self._iterator.initializer, feed_dict={self._pipe_batches: np.repeat(batches, len(windows), axis=0),
+                                                        self._pipe_starts: starts, self._pipe_stops: stops})
+
+    def _train_minibatches(self, train_epoch, sess, xs_, ys_, res, train, windows, shuffle):
+        """Run one epoch over all the minibatches, with `train_epoch` running each of them
+
+        Returns:
+            epoch fetches of the last minibatch, results over the whole batch and loss averaged over the minibatches
+        """
+        if self._batch_size is None and not self._pipeline:
+            return train_epoch(sess, xs_, ys_, res, train, windows)
+        batches = self._minibatches(self.n_batch, self._batch_size, shuffle)
+        if self._pipeline:
+            self._start_pipeline(sess, batches, windows, len(train[1]))
+        masks = self._minibatch_mask(batches, self.n_batch)
+        results = None
+        train_loss = 0.
+        for idx, mask in zip(batches, masks):
+            data = None if self._pipeline else self._take(train, idx)
+            # the padding of the last minibatch is left out of the loss
+            self._batch_feed = {self._batch_mask: mask} if self._batch_mask is not None else {}
+            fetched, res_b, loss_b = train_epoch(sess, xs_, ys_, res, data, windows)
+            if results is None:
+                results = np.zeros(res_b.shape[:2] + (self.n_batch,) + res_b.shape[3:], dtype=res_b.dtype)
+            keep = mask > 0
+            results[:, :, idx[keep]] = res_b[:, :, keep]
+            train_loss = train_loss + loss_b * np.sum(mask) / self.n_batch
+        self._batch_feed = {}
+        return fetched, results, train_loss
+
+    def _test_minibatches(self, sess, xs_, ys_, res, test):
+        """Evaluate the loss and results on the test data, one minibatch at a time
+
+        Returns:
+            loss averaged over the minibatches and results over the whole batch
+        """
+        n = test[1].shape[1]
+        batches = self._minibatches(n, min(self._batch_size, n))
+        results = None
+        test_loss = 0.
+        for idx in batches:
+            data = self._take(test, idx)
+            if len(idx) < self._batch_size:
+                # the graph expects full minibatches
+                data = self._take(data, np.resize(np.arange(len(idx)), self._batch_size))
+            feed_d = {ys_[i]: m for i, m in enumerate(data[-1]) if m is not None}
+            feed_d[xs_] = data[1]
+            if self._batch_mask is not None:
+                feed_d[self._batch_mask] = (np.arange(self._batch_size) < len(idx)).astype(np.float32)
+            loss_b, res_b = sess.run([self._loss, res], feed_dict=feed_d)
+            if results is None:
+                results = np.zeros(res_b.shape[:2] + (n,) + res_b.shape[3:], dtype=res_b.dtype)
+            results[:, :, idx] = res_b[:, :, :len(idx)]
+            test_loss = test_loss + loss_b * len(idx) / n
+        return test_loss, results
+
+    def _train_epoch(self, sess, xs_, ys_, res, train, windows):
+        """Run one epoch, with one update of the parameters per window.
+        The final state of a window is the initial state of the next one, without gradient going through it.
+        The `_epoch_fetches` are fetched with the last window.
+
+        Args:
+            sess(tf.Session): session
+            xs_(tf.Tensor): input placeholder
+            ys_(list): placeholders of the measurements
+            res(tf.Tensor): results of the run
+            train(list): training data, None if it comes from the input pipeline
+            windows(list of slice): windows on the time axis
+
+        Returns:
+            epoch fetches, results over all windows and loss averaged over time
+        """
+        state = None
+        results = []
+        train_loss = 0.
+        for k, w in enumerate(windows):
+            feed_d = {}
+            if train is not None:
+                feed_d = {ys_[i]: m[w] for i, m in enumerate(train[-1]) if m is not None}
+                feed_d[xs_] = train[1][w]
+            feed_d.update(self._batch_feed)
+            fetches = {'res': res, 'train': self.train_op, 'loss': self._loss}
+            if len(windows) > 1:
+                fetches['state'] = self._state_out
+                if state is not None:
+                    feed_d.update(zip(self._state_in, state))
+            if k == len(windows) - 1:
+                fetches['epoch'] = self._epoch_fetches
+            out = sess.run(fetches, feed_dict=feed_d)
+            state = out.get('state')
+            results.append(out['res'])
+            train_loss = train_loss + out['loss'] * len(out['res'])
+        results = np.concatenate(results)
+        return out['epoch'], results, train_loss / len(results)
+
+    def _train_epoch_checkpoint(self, sess, xs_, ys_, res, train, windows):
+        """Run one epoch keeping in memory the activations of one chunk at a time.
+        The gradients are accumulated over the chunks by `_checkpoint_grads`, and the parameters are updated once
+        at the end.
+
+        Args:
+            sess(tf.Session): session
+            xs_(tf.Tensor): input placeholder
+            ys_(list): placeholders of the measurements
+            res(tf.Tensor): results of the run
+            train(list): training data
+            windows(list of slice): chunks on the time axis
+
+        Returns:
+            epoch fetches, results over all chunks and loss averaged over time
+        """
+        grads, results, train_loss = self._checkpoint_grads(sess, xs_, ys_, res, train, windows)
+        fetched, _ = sess.run([self._epoch_fetches, self.train_op], feed_dict=dict(zip(self._acc_grads, grads)))
+        return fetched, results, train_loss
+
+    def _checkpoint_grads(self, sess, xs_, ys_, res, train, windows):
+        """Compute the gradients of the loss over the whole traces, keeping in memory the activations of one chunk
+        at a time. A forward pass stores the states at the start of each chunk, then each chunk is run again from
+        its start state, in reverse order, to accumulate the gradients.
+
+        Args:
+            sess(tf.Session): session
+            xs_(tf.Tensor): input placeholder
+            ys_(list): placeholders of the measurements
+            res(tf.Tensor): results of the run
+            train(list): training data
+            windows(list of slice): chunks on the time axis
+
+        Returns:
+            list of ndarray, ndarray, ndarray: gradients of the variables of `_build_chunk_grads`, results over all
+            chunks and loss averaged over time
+        """
+        length = len(train[1])
+        starts = [None]
+        for w in windows[:-1]:
+            feed_d = {xs_: train[1][w]}
+            if starts[-1] is not None:
+                feed_d.update(zip(self._state_in, starts[-1]))
+            starts.append(sess.run(self._state_out, feed_dict=feed_d))
+
+        grads = None
+        adjoints = None
+        results = []
+        train_loss = 0.
+        for w, start in zip(reversed(windows), reversed(starts)):
+            feed_d = {ys_[i]: m[w] for i, m in enumerate(train[-1]) if m is not None}
+            feed_d.update(self._batch_feed)
+            feed_d[xs_] = train[1][w]
+            n = len(train[1][w])
+            feed_d[self._loss_scale] = n / length
+            if start is not None:
+                feed_d.update(zip(self._state_in, start))
+            if adjoints is not None:
+                feed_d.update(zip(self._adjoints, adjoints))
+            g, adjoints, res_w, loss_w = sess.run([self._chunk_grads, self._state_grads, res, self._loss],
+                                                  feed_dict=feed_d)
+            grads = g if grads is None else [a + b for a, b in zip(grads, g)]
+            results.insert(0, res_w)
+            train_loss = train_loss + loss_w * n / length
+        return grads, np.concatenate(results), train_loss
+
     def optimize(self, dir, train_=None, test_=None, w=None, epochs=700, l_rate=(0.1, 9, 0.92), suffix='', step='',
-                 reload=False, reload_dir=None, yshape=None, evol_var=True, plot=True):
+                 reload=False, reload_dir=None, yshape=None, evol_var=True, plot=True, window=None, shooting=None,
+                 w_shooting=1., checkpoint=None, batch_size=None, shuffle=True, pipeline=False):
 
         print('Optimization'.center(40,'_'))
 
+        if shooting is not None:
+            if window is not None:
+                raise ValueError('The windowed and multiple shooting modes are exclusive')
+            if int(shooting) != shooting or shooting < 2:
+                raise ValueError('The number of segments should be an integer greater than 1, got {}'.format(shooting))
+            shooting = int(shooting)
+        self._shooting = shooting
+        if checkpoint is not None and (window is not None or shooting is not None):
+            raise ValueError('The checkpointed mode is exclusive with the windowed and multiple shooting modes')
+        self._checkpoint = checkpoint
+        if batch_size is not None:
+            if shooting is not None:
+                raise ValueError('The minibatch and multiple shooting modes are exclusive')
+            self._minibatches(train_[1].shape[1], batch_size)
+        self._batch_size = batch_size
+        if pipeline and (checkpoint is not None or shooting is not None):
+            raise ValueError('The input pipeline is exclusive with the checkpointed and multiple shooting modes')
+        self._pipeline = pipeline
+
         T, X, res_targ = train_
         if w is None:
             w = [1] + [0 for _ in range(1, len(res_targ))]
@@ -271,28 +992,48 @@ class Optimizer(ABC):
             reload_dir = dir
 
         xs_, ys_, res, train, test = self._init(dir, suffix, copy.deepcopy(train_), copy.deepcopy(test_), l_rate, w, yshape)
+        if checkpoint is None:
+            windows = self._windows(len(train[1]), window)
+            train_epoch = self._train_epoch
+        else:
+            windows = self._windows(len(train[1]), checkpoint)
+            train_epoch = self._train_epoch_checkpoint
 
         self._build_loss(res, ys_, w)
+        if self._shooting is not None:
+            self._loss = self._loss + w_shooting * self._continuity_loss(res)
         self._build_train()
         self.summary = tf.summary.merge_all()
         session_conf = tf.ConfigProto(
             intra_op_parallelism_threads=INTRA_PAR,
             inter_op_parallelism_threads=INTER_PAR)
 
-        with tf.Session(config=session_conf) as sess:
+        plot_out, plot_args = self._plot_job()
+        # the workers are started before the session
+        with plotter.Plotter(self.plot_processes if plot else 0, self.plot_interval) as plots, \
+                tf.Session(config=session_conf) as sess, utils.AsyncWriter(self.writer_queue) as writer:
 
             self.tdb = tf.summary.FileWriter(self.dir + '/tensorboard',
                                              sess.graph)
 
             sess.run(tf.global_variables_initializer())
+            if self._pipeline:
+                # load the training data once in the session
+                sess.run(tf.local_variables_initializer(), feed_dict=self._data_feed)
+                self._data_feed = None
             losses = np.zeros((epochs, self._parallel))
             rates = np.zeros(epochs)
 
             if reload:
                 """Get variables and measurements from previous steps"""
-                self.saver.restore(sess, '%s/%s' % (reload_dir, SAVE_PATH + suffix))
-                with open(reload_dir + '/' + FILE_LV + suffix, 'rb') as f:
-                    l, self._test_losses, r, vars = pickle.load(f)
+                ckpt = tf.train.latest_checkpoint('%s/%s' % (reload_dir, utils.TMP_DIR), CKPT_STATE + suffix)
+                # the checkpoints of older versions have no step in their name
+                self.saver.restore(sess, ckpt or '%s/%s' % (reload_dir, SAVE_PATH + suffix))
+                l, lt, r, vars = _load_lv(reload_dir, suffix)
+                # copied in memory before the log is replaced, the arrays being mapped from its files
+                l, lt, r = np.array(l), np.array(lt), np.array(r)
+                vars = {var: np.array(val) for var, val in vars.items()}
+                self._test_losses = list(lt)
                 losses = np.concatenate((l, losses))
                 rates = np.concatenate((r, rates))
                 # sess.run(tf.assign(self.global_step, 200))
@@ -301,69 +1042,90 @@ class Optimizer(ABC):
                 vars = {var : np.array([val]) for var, val in self.optimized.init_params.items()}
                 len_prev = 0
 
-            if(evol_var):
-                vars = {var: np.vstack((val, np.zeros([epochs] + list(val.shape)[1:]))) for var, val in vars.items()}
-            else:
-                vars = {var: np.vstack((val, np.zeros([1] + list(val.shape)[1:]))) for var, val in vars.items()}
+            # the history goes to the log, one record per epoch, and is read back from it for the plots
+            log_path = self.dir + LOG_DIR + self.suffix
+            log = trainlog.TrainLog(log_path, dict([('loss', losses.shape[1:]), ('loss_test', losses.shape[1:]),
+                                                    ('rate', ())] +
+                                                   [(VARS_COL + var, val.shape[1:]) for var, val in vars.items()]))
+            log.extend(dict([('loss', losses[:len_prev]), ('loss_test', self._test_losses if reload else []),
+                             ('rate', rates[:len_prev])] + [(VARS_COL + var, val) for var, val in vars.items()]))
+            del vars
 
-            feed_d = {ys_[i]: m for i, m in enumerate(train[-1]) if m is not None}
-            feed_d[xs_] = train[1]
             if test is not None:
                 feed_d_test = {ys_[i]: m for i, m in enumerate(test[-1]) if m is not None}
                 feed_d_test[xs_] = test[1]
-            for j in tqdm(range(epochs)):
+                if self._shooting is not None:
+                    feed_d_test[self._state_in[0]] = self._test_starts
+            for j in tqdm.tqdm(range(epochs)):
                 i = len_prev + j
 
-                summ, results, _, train_loss = sess.run([self.summary, res, self.train_op, self._loss], feed_dict=feed_d)
-
-                self.tdb.add_summary(summ, i)
-
-                self.optimized.apply_constraints(sess)
-
-                if evol_var or j == epochs - 1:
-                    for name, v in self.optimized.variables.items():
-                        v_ = sess.run(v)
-                        if evol_var:
-                            vars[name][i + 1] = v_
-                        else:
-                            vars[name][-1] = v_
-
-                rates[i] = sess.run(self.learning_rate)
+                last = j == epochs - 1
+                self._epoch_fetches = {'rate': self.learning_rate}
+                if j % self.freq_summary == 0 or last:
+                    self._epoch_fetches['summary'] = self.summary
+                fetched, results, train_loss = self._train_minibatches(train_epoch, sess, xs_, ys_, res, train,
+                                                                       windows, shuffle)
+                results = self._unsegment(results)
+
+                if 'summary' in fetched:
+                    self.tdb.add_summary(fetched['summary'], i)
+
+                if evol_var or last:
+                    if j % self.freq_vars == 0 or last:
+                        # one fetch for all the variables
+                        snapshot = sess.run(self.optimized.variables)
+                    else:
+                        # in between snapshots, the records keep the epochs aligned without repeating stale values
+                        snapshot = dict.fromkeys(self.optimized.variables, np.nan)
+                    writer.submit(log.append, {VARS_COL + name: v_ for name, v_ in snapshot.items()})
+
+                rates[i] = fetched['rate']
                 losses[i] = train_loss
+                writer.submit(log.append, {'loss': losses[i].copy(), 'rate': rates[i]})
                 if self._parallel > 1:
                     train_loss = np.nanmean(train_loss)
                 print("[{}] loss : {}".format(i, train_loss))
 
                 if plot:
-                    self.plot_out(X, results, res_targ, suffix, step, 'train', i)
+                    plots.submit('train', plot_out, *plot_args, X, results, res_targ, suffix, step, 'train', i)
 
                 if i % self.freq_test == 0 or j == epochs - 1:
                     res_test = None
                     if test is not None:
-                        test_loss, res_test = sess.run([self._loss, res], feed_dict=feed_d_test)
+                        if self._batch_size is None:
+                            test_loss, res_test = sess.run([self._loss, res], feed_dict=feed_d_test)
+                        else:
+                            test_loss, res_test = self._test_minibatches(sess, xs_, ys_, res, test)
+                        res_test = self._unsegment(res_test)
                         self._test_losses.append(test_loss)
+                        writer.submit(log.append, {'loss_test': test_loss})
 
-                    with (open(self.dir + FILE_LV + self.suffix, 'wb')) as f:
-                        pickle.dump([losses, self._test_losses, rates, vars], f)
-
-                    self.saver.save(sess, "{}{}{}".format(self.dir, SAVE_PATH, self.suffix))
+                    # the previous checkpoint is written before its copy is replaced
+                    writer.flush()
+                    sess.run(self._snapshot_op)
+                    writer.submit(self._snapshot_saver.save, sess, "{}{}{}".format(self.dir, SAVE_PATH, self.suffix),
+                                  global_step=i, latest_filename=CKPT_STATE + self.suffix)
 
                     if plot:
-                        plot_loss_rate(losses[:i + 1], rates[:i + 1], losses_test=self._test_losses,
-                                       parallel=self._parallel, suffix=self.suffix, show=False, save=True)
+                        plots.submit('loss', plot_loss_rate, losses[:i + 1].copy(), rates[:i + 1].copy(),
+                                     losses_test=list(self._test_losses), parallel=self._parallel,
+                                     suffix=self.suffix, show=False, save=True)
                         if evol_var:
-                            self.optimized.plot_vars(dict([(name, val[:i + 2]) for name, val in vars.items()]),
-                                                 suffix=self.suffix + "evolution", show=False, save=True)
+                            # after the records of the epoch are written
+                            writer.submit(plots.submit, 'vars', plot_log_vars, log_path, self.optimized.plot_vars,
+                                          self.suffix + "evolution")
                     if res_test is not None and plot:
-                        self.plot_out(X_test, res_test, res_targ_test, suffix, step, 'test', i)
-
-                    with open(self.dir + FILE_OBJ, 'wb') as f:
-                        self.optimized.predump(sess)
-                        pickle.dump(self.optimized, f)
+                        plots.submit('test', plot_out, *plot_args, X_test, res_test, res_targ_test, suffix, step, 'test',
+                                     i)
 
+                    self.optimized.predump(sess)
+                    # pickled now, the object keeps changing
+                    writer.submit(utils.write_file, pickle.dumps(self.optimized), self.dir + FILE_OBJ,
+                                  self.keep_snapshots)
 
             with open(self.dir + 'time', 'w') as f:
                 f.write(str(time.time() - self.start_time))
+            writer.submit(log.close)
 
         # plot evolution of variables
         p = get_vars(self.dir)
@@ -388,6 +1150,42 @@ def get_model(dir):
         obj = pickle.load(f)
     return obj
 
+def _load_lv(dir, suffix=''):
+    """Give the history of an optimization, from its log or from the dumped file of older versions.
+    The arrays are mapped from the log, only the records used are read.
+
+    Args:
+      dir(str): path to the directory
+      suffix(str): suffix of the optimization (Default value = '')
+
+    Returns:
+        losses, test losses, learning rates and dict of variables, each with one record per epoch
+    """
+    path = dir + '/' + LOG_DIR + suffix
+    if trainlog.exists(path):
+        dic = {name[len(VARS_COL):]: trainlog.read(path, name) for name in trainlog.columns(path)
+               if name.startswith(VARS_COL)}
+        return trainlog.read(path, 'loss'), trainlog.read(path, 'loss_test'), trainlog.read(path, 'rate'), dic
+    with open(dir + '/' + FILE_LV + suffix, 'rb') as f:
+        return pickle.load(f, encoding="latin1")
+
+def plot_log_vars(path, plot_vars, suffix):
+    """Plot the evolution of the variables recorded so far in a log
+
+    Args:
+        path(str): directory of the log
+        plot_vars(callable): function plotting the variables, like `Optimized.plot_vars`
+        suffix(str): suffix for the saved file
+    """
+    names = [name for name in trainlog.columns(path) if name.startswith(VARS_COL)]
+    dic = {name[len(VARS_COL):]: np.array(trainlog.read(path, name)) for name in names}
+    if dic:
+        # only the epochs with a snapshot of the variables, the other records being NaN
+        v = next(iter(dic.values()))
+        snap = ~np.isnan(np.reshape(v, (len(v), -1))[:, 0])
+        dic = {var: val[snap] for var, val in dic.items()}
+    plot_vars(dic, suffix=suffix, show=False, save=True)
+
 def get_vars(dir, i=-1, loss=False):
     """get dic of vars from dumped file
 
@@ -397,14 +1195,10 @@ def get_vars(dir, i=-1, loss=False):
     Returns:
 
     """
-    file = dir + '/' + FILE_LV
-    with open(file, 'rb') as f:
-        load = pickle.load(f, encoding="latin1")
-        l = load[0]
-        dic = load[-1]
-        if loss:
-            dic['loss'] = l
-        dic = dict([(var, np.array(val[i], dtype=np.float32)) for var, val in dic.items()])
+    l, _, _, dic = _load_lv(dir)
+    if loss:
+        dic['loss'] = l
+    dic = dict([(var, np.array(val[i], dtype=np.float32)) for var, val in dic.items()])
     return dic
 
 def get_vars_all(dir, i=-1, losses=False):
@@ -416,18 +1210,12 @@ def get_vars_all(dir, i=-1, losses=False):
     Returns:
 
     """
-    file = dir + '/' + FILE_LV
-    with open(file, 'rb') as f:
-        load = pickle.load(f, encoding="latin1")
-        l = load[0]
-        lt = load[1]
-        rates = load[2]
-        dic = load[-1]
-        if losses:
-            dic['loss'] = l
-            dic['loss_test'] = lt
-            dic['rates'] = rates
-        dic = {var: val[:i] for var, val in dic.items()}
+    l, lt, rates, dic = _load_lv(dir)
+    if losses:
+        dic['loss'] = l
+        dic['loss_test'] = lt
+        dic['rates'] = rates
+    dic = {var: np.array(val[:i]) for var, val in dic.items()}
     return dic
 
 
@@ -441,23 +1229,19 @@ def get_best_result(dir, i=-1, loss=False):
       
 
     """
-    file = dir + '/' + FILE_LV
-    with open(file, 'rb') as f:
-        load = pickle.load(f, encoding="latin1")
-        l = load[0]
-        dic = load[-1]
-        idx = np.nanargmin(l[-1])
-        # [epoch, model] for neuron, [epoch, element, model] for circuit
-        ndim = list(dic.values())[0].ndim
-        if l.shape[1] > 1:
-            if ndim > 2:
-                dic = dict([(var, np.array(val[i, :, idx], dtype=np.float32)) for var, val in dic.items()])
-            else:
-                dic = dict([(var, np.array(val[i,idx], dtype=np.float32)) for var, val in dic.items()])
+    l, _, _, dic = _load_lv(dir)
+    idx = np.nanargmin(l[-1])
+    # [epoch, model] for neuron, [epoch, element, model] for circuit
+    ndim = list(dic.values())[0].ndim
+    if l.shape[1] > 1:
+        if ndim > 2:
+            dic = dict([(var, np.array(val[i, :, idx], dtype=np.float32)) for var, val in dic.items()])
         else:
-            dic = dict([(var, np.array(val[i], dtype=np.float32)) for var, val in dic.items()])
-        if (loss):
-            dic['loss'] = l[i, idx]
+            dic = dict([(var, np.array(val[i,idx], dtype=np.float32)) for var, val in dic.items()])
+    else:
+        dic = dict([(var, np.array(val[i], dtype=np.float32)) for var, val in dic.items()])
+    if (loss):
+        dic['loss'] = l[i, idx]
     return dic
 
 
@@ -0,0 +1,158 @@
+"""
+.. module:: parallel
+    :synopsis: Module running NumPy simulations in a pool of processes, with inputs and results in shared memory
+
+.. moduleauthor:: Marc Javin
+"""
+
+import multiprocessing
+
+import numpy as np
+
+_values = {}
+
+
+class SharedArray(object):
+    """Array in shared memory, given to the workers of a `SharedPool` without being copied"""
+
+    def __init__(self, shape, dtype):
+        """
+        Args:
+            shape(tuple): shape of the array
+            dtype: type of the elements
+        """
+        self.shape = tuple(int(s) for s in shape)
+        self.dtype = np.dtype(dtype)
+        self._raw = multiprocessing.RawArray('b', max(1, int(np.prod(self.shape)) * self.dtype.itemsize))
+
+    @classmethod
+    def copy(cls, a):
+        """Give a shared array filled with `a`"""
+        a = np.asarray(a)
+        shared = cls(a.shape, a.dtype)
+        shared.view()[...] = a
+        return shared
+
+    def view(self):
+        """Give the array, backed by the shared memory"""
+        return np.frombuffer(self._raw, dtype=self.dtype, count=int(np.prod(self.shape))).reshape(self.shape)
+
+
+def _init(values):
+    global _values
+    _values = {name: v.view() if isinstance(v, SharedArray) else v for name, v in values.items()}
+
+
+def get(name):
+    """Give a value of the pool running the current worker, shared arrays being given as ndarrays
+
+    Args:
+        name(str): name of the value
+    """
+    return _values[name]
+
+
+class SharedPool(object):
+    """Pool of processes sharing some values.
+    The values are sent once to each worker, where jobs read them with `get`. Shared arrays are not copied: the
+    workers and the pool see the same memory, in which jobs can also write their results.
+    """
+
+    def __init__(self, workers=None, **values):
+        """
+        Args:
+            workers(int): number of processes, one per processor if None
+            values: values given to the workers, by name
+        """
+        self._pool = multiprocessing.Pool(workers, _init, (values,))
+        self.arrays = {name: v.view() for name, v in values.items() if isinstance(v, SharedArray)}
+
+    def apply_async(self, fun, args=()):
+        """Run `fun(*args)` in a worker
+
+        Returns:
+            AsyncResult: result of the job
+        """
+        return self._pool.apply_async(fun, args)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self._pool.close()
+        else:
+            self._pool.terminate()
+        self._pool.join()
+
+
+def _outputs(res):
+    return res if isinstance(res, tuple) else (res,)
+
+
+def _calculate(m, cols):
+    """Simulate the model `m` on the columns `cols` of the batch, or on the whole input if None, and write its
+    outputs"""
+    model = get('models')[m]
+    i_inj = get('i_inj')
+    res = _outputs(model.calculate(i_inj if cols is None else i_inj[:, cols]))
+    for k, (r, axis) in enumerate(zip(res, get('axes'))):
+        out = get('out%s' % k)[m]
+        out[Ellipsis if cols is None else (slice(None),) * axis + (cols,)] = r
+
+
+def _batch_axis(full, col):
+    """Give the axis of an output shrinking when the input has a single column, None if there is none"""
+    axes = [a for a, (s, c) in enumerate(zip(full.shape, col.shape)) if s != c]
+    return axes[0] if axes else None
+
+
+def calculate(models, i_inj, workers=None):
+    """Simulate models with the same input current in a pool of processes.
+    A single model has the columns of its batch split between the workers, a list of models is split by model.
+    The input of a vectorised model, like a `PyBioNeuron` with several parameter sets, can have one column per set:
+    the columns then go with the parameters and are simulated in a single job.
+    The outputs are written in shared memory in the order of the models and of the batch, whatever the order in
+    which the workers finish.
+
+    Args:
+        models(object or list): simulator with a `calculate` method, like `PyBioNeuron` or `Circuit`, or a list of
+            simulators whose outputs have the same shapes
+        i_inj(ndarray): input currents of shape [time, (batch, ...)], the same for each model of a list
+        workers(int): number of processes, one per processor if None, and 0 to simulate in this process
+
+    Returns:
+        ndarray or tuple: outputs of `calculate`, stacked along a first axis if `models` is a list
+    """
+    i_inj = np.asarray(i_inj)
+    single = not isinstance(models, (list, tuple))
+    if single:
+        models = [models]
+    if workers == 0:
+        res = [_outputs(m.calculate(i_inj)) for m in models]
+        res = tuple(np.stack(r) for r in zip(*res))
+    else:
+        # shapes of the outputs from the first time step
+        probe = _outputs(models[0].calculate(i_inj[:1]))
+        n_batch = i_inj.shape[1] if single and i_inj.ndim > 1 else 1
+        axes = [None for _ in probe]
+        if n_batch > 1:
+            # the batch axis of each output is the one shrinking with the input
+            col = _outputs(models[0].calculate(i_inj[:1, :1]))
+            axes = [_batch_axis(p, q) for p, q in zip(probe, col)]
+        if None not in axes:
+            n_jobs = min(n_batch, workers or multiprocessing.cpu_count())
+            bounds = np.linspace(0, n_batch, n_jobs + 1).astype(int)
+            jobs = [(0, slice(s, e)) for s, e in zip(bounds[:-1], bounds[1:])]
+        else:
+            # no batch to split: 1D input, list of models, or columns going with the parameters of the model
+            jobs = [(m, None) for m in range(len(models))]
+        outs = {'out%s' % k: SharedArray((len(models), len(i_inj)) + p.shape[1:], p.dtype)
+                for k, p in enumerate(probe)}
+        with SharedPool(workers, models=models, i_inj=SharedArray.copy(i_inj), axes=axes, **outs) as pool:
+            for r in [pool.apply_async(_calculate, job) for job in jobs]:
+                r.get()
+            res = tuple(pool.arrays['out%s' % k] for k in range(len(probe)))
+    if single:
+        res = tuple(r[0] for r in res)
+    return res if len(res) > 1 else res[0]
@@ -0,0 +1,94 @@
+"""
+.. module:: plotter
+    :synopsis: Module running plots in worker processes, away from the training loop
+
+.. moduleauthor:: Marc Javin
+"""
+
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+
+from . import utils
+
+
+def _render(dir, fun, args, kwargs):
+    """Run a plotting job in a worker, saving in the directory of the submitting process"""
+    utils._current_dir = dir
+    fun(*args, **kwargs)
+
+
+class Plotter(object):
+    """Run plotting jobs in a pool of worker processes.
+    Each job has a key, like the kind of plot it renders. A job of a key starts once the previous one is finished
+    and at least `interval` seconds after it started. Until then, it waits and is replaced by any newer job with
+    the same key, so only the latest one is rendered. Leaving the context renders the last jobs of every key and
+    waits for them.
+    The function and arguments of a job are sent to the workers, they have to be picklable. Jobs can be submitted
+    from several threads.
+    """
+
+    def __init__(self, processes=1, interval=0.):
+        """
+        Args:
+            processes(int): number of worker processes, 0 to render the plots when they are submitted
+            interval(float): minimum time in seconds between the start of two jobs with the same key
+        """
+        self._interval = interval
+        self._pool = multiprocessing.Pool(processes) if processes > 0 else None
+        self._pending = OrderedDict()
+        self._running = {}
+        self._started = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, fun, *args, **kwargs):
+        """Queue the plot `fun(*args, **kwargs)`, replacing the pending one with the same key
+
+        Args:
+            key: kind of the plot
+            fun(callable): plotting function
+        """
+        with self._lock:
+            if self._pool is None:
+                _render(utils._current_dir, fun, args, kwargs)
+                return
+            self._pending[key] = (utils._current_dir, fun, args, kwargs)
+            self._dispatch()
+
+    def _dispatch(self, force=False):
+        for key in list(self._pending):
+            running = self._running.get(key)
+            if running is not None:
+                if not running.ready():
+                    continue
+                # raise the errors of the job
+                running.get()
+                del self._running[key]
+            if not force and time.time() - self._started.get(key, -float('inf')) < self._interval:
+                continue
+            self._started[key] = time.time()
+            self._running[key] = self._pool.apply_async(_render, self._pending.pop(key))
+
+    def close(self):
+        """Render the pending jobs and wait for all of them"""
+        with self._lock:
+            while self._pending:
+                for running in self._running.values():
+                    running.wait()
+                self._dispatch(force=True)
+            for running in self._running.values():
+                running.get()
+            self._running = {}
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self._pool is not None:
+            self._pool.terminate()
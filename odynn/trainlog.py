@@ -0,0 +1,119 @@
+"""
+.. module:: trainlog
+    :synopsis: Module for the append-only log of an optimization, with one record per epoch and per column
+
+.. moduleauthor:: Marc Javin
+"""
+
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from . import utils
+
+META_FILE = 'columns.json'
+DTYPE = np.float32
+
+
+class TrainLog(object):
+    """Append-only log of an optimization.
+    Each column is stored in its own binary file of fixed-size records, so that appending costs the same at every
+    epoch and a reader can map a single column, and read one record of it, even while the log is being written.
+    """
+
+    def __init__(self, path, columns):
+        """Create a new log, replacing any previous one in `path`
+
+        Args:
+            path(str): directory of the log
+            columns(dict): shape of the records of each column
+        """
+        self.path = path
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self._shapes = OrderedDict()
+        self._files = {}
+        meta = []
+        for k, (name, shape) in enumerate(columns.items()):
+            file = '{}.bin'.format(k)
+            self._shapes[name] = tuple(shape)
+            self._files[name] = open(os.path.join(path, file), 'wb')
+            meta.append({'name': name, 'shape': list(shape), 'file': file})
+        utils.write_file(json.dumps(meta).encode(), os.path.join(path, META_FILE))
+
+    def append(self, records):
+        """Append one record to some columns
+
+        Args:
+            records(dict): value of the new record for each column, broadcast to the shape of the column
+        """
+        for name, val in records.items():
+            f = self._files[name]
+            val = np.broadcast_to(np.asarray(val, dtype=DTYPE), self._shapes[name])
+            f.write(np.ascontiguousarray(val).tobytes())
+            f.flush()
+
+    def extend(self, records):
+        """Append several records to some columns
+
+        Args:
+            records(dict): records to append for each column, stacked along the first axis
+        """
+        for name, vals in records.items():
+            for val in vals:
+                self.append({name: val})
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def exists(path):
+    """True if `path` contains a log"""
+    return os.path.exists(os.path.join(path, META_FILE))
+
+
+def columns(path):
+    """Give the columns of a log
+
+    Args:
+        path(str): directory of the log
+
+    Returns:
+        OrderedDict: shape of the records of each column
+    """
+    with open(os.path.join(path, META_FILE)) as f:
+        meta = json.load(f)
+    return OrderedDict((c['name'], tuple(c['shape'])) for c in meta)
+
+
+def read(path, name):
+    """Map the complete records of one column, without loading them
+
+    Args:
+        path(str): directory of the log
+        name(str): name of the column
+
+    Returns:
+        ndarray: read-only records of shape [record, ...]
+    """
+    with open(os.path.join(path, META_FILE)) as f:
+        col = [c for c in json.load(f) if c['name'] == name]
+    if not col:
+        raise KeyError('No column {} in the log {}'.format(name, path))
+    shape = tuple(col[0]['shape'])
+    file = os.path.join(path, col[0]['file'])
+    size = int(np.prod(shape)) * np.dtype(DTYPE).itemsize
+    # a record still being written is ignored
+    n = os.path.getsize(file) // size if size > 0 else 0
+    if n == 0:
+        return np.zeros((0,) + shape, dtype=DTYPE)
+    return np.memmap(file, dtype=DTYPE, mode='r', shape=(n,) + shape)
@@ -4,10 +4,11 @@
 
 .. moduleauthor:: Marc Javin
 """
+import importlib
 import numpy as np
 import os
-import pylab as plt
-import seaborn as sns
+import queue
+import threading
 
 COLORS = np.array([ 'k', 'c', 'Gold', 'Darkred', 'b', 'Orange', 'm', 'Lime', 'Salmon', 'Indigo', 'DarkGrey', 'Crimson', 'Olive'])
 
@@ -23,6 +24,47 @@ OUT_SETTINGS = 'settings'
 REGEX_VARS = '(.*) : (.*)'
 
 
+class LazyModule(object):
+    """Module imported at the first access to one of its attributes, to keep heavy dependencies (plots,
+    graphs, tensorflow) out of the import of odynn"""
+
+    def __init__(self, name, load=None):
+        """
+        Args:
+            name(str): name of the module
+            load(callable): if not None, function importing and returning the module
+        """
+        self._name = name
+        self._load = load
+        self._module = None
+
+    def __getattr__(self, attr):
+        if attr.startswith('__'):
+            raise AttributeError(attr)
+        if self._module is None:
+            self._module = self._load() if self._load is not None else importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+def _load_pylab():
+    import matplotlib as mpl
+    # Use on my server
+    if "SSH_CONNECTION" in os.environ:
+        mpl.use("Agg")
+    import pylab
+    # Tune the plots appearance
+    SMALL_SIZE = 8
+    pylab.rc('xtick', labelsize=SMALL_SIZE)  # fontsize of the tick labels
+    pylab.rc('ytick', labelsize=SMALL_SIZE)  # fontsize of the tick labels
+    return pylab
+
+
+plt = LazyModule('pylab', _load_pylab)
+sns = LazyModule('seaborn')
+pd = LazyModule('pandas')
+tf = LazyModule('tensorflow')
+
+
 class classproperty(object):
 
     def __init__(self, fget):
@@ -69,6 +111,125 @@ def save_show(show, save, name='', dpi=500):
     plt.close()
 
 
+def write_file(data, path, keep=0):
+    """Write `data` to `path` atomically, so that readers never see a partial file
+
+    Args:
+        data(bytes): content of the file
+        path(str): path of the file
+        keep(int): number of previous versions to keep, as `path`.1 (the most recent) to `path`.`keep`
+            (Default value = 0)
+    """
+    for k in range(keep, 0, -1):
+        older = path if k == 1 else '{}.{}'.format(path, k - 1)
+        if os.path.exists(older):
+            os.replace(older, '{}.{}'.format(path, k))
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class AsyncWriter(object):
+    """Run saving and plotting jobs in a background thread, in the order they are submitted.
+    The queue of pending jobs is bounded, `submit` blocks while it is full. Leaving the context waits for all
+    the pending jobs, and errors raised by a job are raised again in the submitting thread.
+    """
+
+    def __init__(self, maxsize=8):
+        """
+        Args:
+            maxsize(int): maximum number of pending jobs
+        """
+        self._queue = queue.Queue(maxsize)
+        self._error = None
+        self._thread = threading.Thread(target=self._work, name='odynn-writer', daemon=True)
+        self._thread.start()
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                fun, args, kwargs = job
+                fun(*args, **kwargs)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _raise(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def submit(self, fun, *args, **kwargs):
+        """Queue the call `fun(*args, **kwargs)`, the arguments must not be modified afterwards"""
+        self._raise()
+        self._queue.put((fun, args, kwargs))
+
+    def flush(self):
+        """Wait for all the pending jobs"""
+        self._queue.join()
+        self._raise()
+
+    def close(self):
+        """Wait for all the pending jobs and stop the thread"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._raise()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.close()
+        except Exception:
+            # do not hide the error leaving the context
+            if exc_type is None:
+                raise
+
+
+def chunks(pieces, size=None):
+    """Regroup the successive pieces of an array along its first axis into chunks of `size` elements
+
+    Args:
+        pieces(ndarray or iterable of ndarray): array, or successive pieces of an array along its first axis, e.g.
+            read from a file or a live source
+        size(int): number of elements of the chunks, the last one can be shorter. If None, the pieces are given
+            as they come, an array being a single piece (Default value = None)
+
+    Yields:
+        ndarray: successive chunks
+    """
+    if isinstance(pieces, np.ndarray):
+        size = size or max(len(pieces), 1)
+        for k in range(0, len(pieces), size):
+            yield pieces[k:k + size]
+        return
+    buf = []
+    n = 0
+    for p in pieces:
+        p = np.asarray(p)
+        if size is None:
+            yield p
+            continue
+        while n + len(p) >= size:
+            buf.append(p[:size - n])
+            yield np.concatenate(buf) if len(buf) > 1 else buf[0]
+            p = p[size - n:]
+            buf = []
+            n = 0
+        if len(p) > 0:
+            buf.append(p)
+            n += len(p)
+    if buf:
+        yield np.concatenate(buf)
+
+
 def bar(ax, var, good_val=None):
     sns.barplot(x=np.arange(len(var)), y=var, ax=ax)
     if good_val is not None:
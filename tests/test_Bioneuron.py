@@ -175,12 +175,16 @@ class TestNeuronTf(TestCase):
         self.assertEqual(i.get_shape().as_list(), [None, None])
         i, res = n.build_graph(batch=1)
         self.assertEqual(i.get_shape().as_list(), [None, None])
+        self.assertEqual(res.get_shape().as_list(), [None, len(n.init_state), 1])
+        # the model axis is left free, so that a current fed with a model axis of 1 is shared by the models
         i, res = nn.build_graph()
-        self.assertEqual(i.get_shape().as_list(), [None, 8])
+        self.assertEqual(i.get_shape().as_list(), [None, None])
+        self.assertEqual(res.get_shape().as_list(), [None, len(nn.init_state), 8])
         i, res = nn.build_graph(1)
-        self.assertEqual(i.get_shape().as_list(), [None, None, 8])
+        self.assertEqual(i.get_shape().as_list(), [None, None, None])
+        self.assertEqual(res.get_shape().as_list(), [None, len(nn.init_state), 1, 8])
         i, res = nn.build_graph(batch=4)
-        self.assertEqual(i.get_shape().as_list(), [None, None, 8])
+        self.assertEqual(i.get_shape().as_list(), [None, None, None])
 
     def test_calculate(self):
         n = BioNeuronTf(init_p=p)
@@ -211,6 +215,64 @@ class TestNeuronTf(TestCase):
         self.assertEqual(xx.shape[2], ii.shape[1])  # same nb of batch
         self.assertEqual(xx.all(), xx2.all())
 
+    def test_resume(self):
+        n = BioNeuronTf(init_p=[p for _ in range(2)])
+        i = np.random.uniform(0., 10., (10, 3))
+        x, state = n.calculate(i, return_state=True)
+        self.assertEqual(state.shape, x[-1].shape)
+        x1, s1 = n.calculate(i[:4], return_state=True)
+        x2 = n.calculate(i[4:], init_state=s1)
+        np.testing.assert_allclose(np.concatenate([x1, x2]), x, rtol=1e-5)
+
+    def test_simulator(self):
+        n = BioNeuronTf(init_p=[p for _ in range(2)])
+        i = np.array([2., 3., 0.])
+        x = n.calculate(i)
+        sim = n.simulator(None)
+        self.assertIs(sim, n.simulator(None))
+        self.assertEqual(len(n._simulators), 1)
+        ii = np.stack([i, i], 1)
+        np.testing.assert_allclose(sim.run(ii), x)
+
+        # new parameters are fed without rebuilding the graph
+        params = {var: val * 1.1 for var, val in n.init_params.items()}
+        xp = sim.run(ii, params)
+        self.assertEqual(len(n._simulators), 1)
+        n.init_params = params
+        np.testing.assert_allclose(n.calculate(i), xp)
+        np.testing.assert_allclose(PyBioNeuron(init_p=params).calculate(i), xp, rtol=1e-4)
+
+        n.calculate(np.stack([i] * 4, 1))
+        self.assertEqual(len(n._simulators), 2)
+        n2 = pickle.loads(pickle.dumps(n))
+        self.assertEqual(n2._simulators, {})
+        n.clear_simulators()
+        self.assertEqual(n._simulators, {})
+
+    def test_simulator_structure(self):
+        n = BioNeuronTf(init_p=[p for _ in range(2)], dt=0.1)
+        i = np.full((20, 3), 5.)
+        x = n.calculate(i)
+        # a new time step builds a new graph
+        n.dt = 0.5
+        x_dt = n.calculate(i)
+        self.assertEqual(len(n._simulators), 2)
+        self.assertFalse(np.allclose(x, x_dt))
+        np.testing.assert_allclose(x_dt, PyBioNeuron(init_p=[p for _ in range(2)], dt=0.5).calculate(i[..., None]),
+                                   rtol=1e-4)
+        # a new initial state is fed to the same graph
+        n.dt = 0.1
+        n._init_state = n._init_state.copy()
+        n._init_state[n.V_pos] += 10.
+        x_init = n.calculate(i)
+        self.assertEqual(len(n._simulators), 2)
+        target = PyBioNeuron(init_p=[p for _ in range(2)], dt=0.1)
+        target._init_state = n._init_state
+        np.testing.assert_allclose(x_init, target.calculate(i[..., None]), rtol=1e-4)
+        n._fixed = set(n.parameter_names)
+        n.calculate(i)
+        self.assertEqual(len(n._simulators), 3)
+
 
 class TestNeuronFix(TestCase):
 
@@ -271,3 +333,85 @@ class TestNeuronFix(TestCase):
         self.assertEqual(x.shape[0], i.shape[0]) #same time
         self.assertEqual(x.shape[1], hh._init_state.shape[0])
         self.assertEqual(x.shape[2], i.shape[1]) #same nb of batch
+
+    def test_calculate_changes(self):
+        i = 10. * np.random.rand(50, 3)
+        hh = PyBioNeuron(p, dt=0.1)
+        # the terms depending on the time step and the parameters follow their changes
+        hh.dt = 0.5
+        np.testing.assert_array_equal(hh.calculate(i), PyBioNeuron(p, dt=0.5).calculate(i))
+        pars = PyBioNeuron.get_random()
+        hh._param = pars.copy()
+        np.testing.assert_array_equal(hh.calculate(i), PyBioNeuron(pars, dt=0.5).calculate(i))
+        for var in hh._param:
+            if var.endswith('__tau'):
+                hh._param[var] = 2. * pars[var]
+        target = PyBioNeuron(dict(hh._param), dt=0.5)
+        np.testing.assert_array_equal(hh.calculate(i), target.calculate(i))
+
+    def test_calculate_out(self):
+        hh = PyBioNeuron(init_p=[PyBioNeuron.get_random() for _ in range(4)])
+        i = np.array([[2., 2., 0., 1.], [3., 3., 1., 0.], [0., 0., 4., 2.]])
+        x = hh.calculate(i)
+        out = np.zeros(x.shape)
+        x2 = hh.calculate(i, out=out)
+        self.assertIs(x2, out)
+        np.testing.assert_array_equal(x, x2)
+
+        with self.assertRaises(ValueError):
+            hh.calculate(i, out=np.zeros((3, 2)))
+
+        X = hh.init_state.copy()
+        x = hh.step(X, 2.)
+        self.assertIs(hh.step(X, 2., out=X), X)
+        np.testing.assert_array_equal(x, X)
+
+    def test_calculate_record(self):
+        hh = PyBioNeuron(init_p=[PyBioNeuron.get_random() for _ in range(4)])
+        i = np.random.uniform(0., 10., (50, 3, 1))
+        x = hh.calculate(i)
+        rec = [hh.V_pos, -1]
+        np.testing.assert_array_equal(hh.calculate(i, record=rec, every=7), x[::7][:, rec])
+        np.testing.assert_array_equal(hh.calculate(i, every=3), x[::3])
+        xs = list(hh.simulate_iter(i, chunk=10, record=rec, every=7))
+        np.testing.assert_array_equal(np.concatenate(xs), x[::7][:, rec])
+        with self.assertRaises(ValueError):
+            hh.calculate(i, out=np.zeros(x.shape), every=2)
+
+    def test_calculate_resume(self):
+        hh = PyBioNeuron(init_p=[PyBioNeuron.get_random() for _ in range(4)])
+        i = np.random.uniform(0., 10., (50, 3, 1))
+        x, state = hh.calculate(i, return_state=True)
+        np.testing.assert_array_equal(state, x[-1])
+        x1, s1 = hh.calculate(i[:20], return_state=True)
+        x2 = hh.calculate(i[20:], init_state=s1)
+        np.testing.assert_array_equal(np.concatenate([x1, x2]), x)
+        xs = list(hh.simulate_iter(i[20:], chunk=10, init_state=s1))
+        np.testing.assert_array_equal(np.concatenate(xs), x2)
+
+    def test_simulate_iter(self):
+        hh = PyBioNeuron(init_p=[PyBioNeuron.get_random() for _ in range(4)])
+        i = np.random.uniform(0., 10., (50, 3, 1))
+        x = hh.calculate(i)
+        xs = list(hh.simulate_iter(i, chunk=20))
+        self.assertEqual([len(c) for c in xs], [20, 20, 10])
+        np.testing.assert_array_equal(np.concatenate(xs), x)
+        # pieces of any length, from a generator
+        xs = list(hh.simulate_iter((i[k:k + 7] for k in range(0, 50, 7)), chunk=20))
+        self.assertEqual([len(c) for c in xs], [20, 20, 10])
+        np.testing.assert_array_equal(np.concatenate(xs), x)
+        # empty pieces, e.g. from a live source without new samples
+        xs = list(hh.simulate_iter([i[:30], i[30:30], i[30:]]))
+        self.assertEqual([len(c) for c in xs], [30, 0, 20])
+        np.testing.assert_array_equal(np.concatenate(xs), x)
+        xs = list(hh.simulate_iter([i[:30], i[30:30], i[30:]], record=[0], every=4))
+        np.testing.assert_array_equal(np.concatenate(xs), x[::4][:, [0]])
+
+    def test_update_gates(self):
+        hh = PyBioNeuron(init_p=[PyBioNeuron.get_random() for _ in range(4)])
+        X = np.stack([hh.init_state] * 3, 1)
+        V = np.random.uniform(-60., 20., (3, 4))
+        gates = hh._update_gates(X[1:len(hh._gates) + 1], V)
+        self.assertEqual(gates.shape, (len(hh._gates), 3, 4))
+        for k, g in enumerate(hh._gates):
+            np.testing.assert_allclose(gates[k], hh._update_gate(X[k + 1], g, V))
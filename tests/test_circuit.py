@@ -169,6 +169,14 @@ class TestCircuitTf(TestCase):
         self.assertEqual(st.shape[3], 5)
         self.assertEqual(st.shape[-1], 4)
 
+    def test_resume(self):
+        c = CircuitTf(self.neuron, self.conns, self.gaps)
+        i = np.random.uniform(0., 10., (10, 2, 5))
+        st, state = c.calculate(i, return_state=True)
+        st1, s1 = c.calculate(i[:4], return_state=True)
+        st2 = c.calculate(i[4:], init_state=s1)
+        np.testing.assert_allclose(np.concatenate([st1, st2]), st, rtol=1e-5)
+
 class TestCircuitFix(TestCase):
 
     dir = utils.set_dir('unittest')
@@ -222,3 +230,53 @@ class TestCircuitFix(TestCase):
 
 
 
+
+    def test_simulate_iter(self):
+        c = Circuit(PyBioNeuron([PyBioNeuron.default_params for _ in range(5)], 0.1), self.conns, self.gaps)
+        i = np.random.uniform(0., 10., (30, 2, 5))
+        st, cur = c.calculate(i)
+        res = list(c.simulate_iter(iter([i[:4], i[4:17], i[17:]])))
+        self.assertEqual([len(s) for s, _ in res], [4, 13, 13])
+        np.testing.assert_array_equal(np.concatenate([s for s, _ in res]), st)
+        np.testing.assert_array_equal(np.concatenate([c for _, c in res]), cur)
+
+    def test_calculate_record(self):
+        c = Circuit(PyBioNeuron([PyBioNeuron.default_params for _ in range(5)], 0.1), self.conns2, self.gaps2)
+        i = np.random.uniform(0., 10., (30, 2, 5, 4))
+        st, cur = c.calculate(i)
+        st2, cur2 = c.calculate(i, record=[0, -1], every=4, neurons=[2, 4])
+        self.assertEqual(st2.shape, (8, 2, 2, 2, 4))
+        np.testing.assert_array_equal(st2, st[::4][:, [0, -1]][..., [2, 4], :])
+        np.testing.assert_array_equal(cur2, cur[::4][..., [2, 4], :])
+        res = list(c.simulate_iter(i, chunk=3, record=[0], every=4, neurons=[4]))
+        np.testing.assert_array_equal(np.concatenate([s for s, _ in res]), st[::4][:, [0]][..., [4], :])
+
+    def test_calculate_resume(self):
+        c = Circuit(PyBioNeuron([PyBioNeuron.default_params for _ in range(5)], 0.1), self.conns, self.gaps)
+        i = np.random.uniform(0., 10., (30, 2, 5))
+        st, cur, [h, syn] = c.calculate(i, return_state=True)
+        np.testing.assert_array_equal(h, st[-1])
+        np.testing.assert_array_equal(syn, cur[-1])
+        st1, cur1, state = c.calculate(i[:12], return_state=True)
+        st2, cur2 = c.calculate(i[12:], init_state=state)
+        np.testing.assert_array_equal(np.concatenate([st1, st2]), st)
+        np.testing.assert_array_equal(np.concatenate([cur1, cur2]), cur)
+        res = list(c.simulate_iter(i[12:], chunk=5, init_state=state))
+        np.testing.assert_array_equal(np.concatenate([s for s, _ in res]), st2)
+        # the state of the neurons alone starts without synaptic current
+        st3, _ = c.calculate(i[12:], init_state=[state[0]])
+        np.testing.assert_array_equal(st3, c.calculate(i[12:], init_state=[state[0], None])[0])
+        with self.assertRaises(ValueError):
+            c.calculate(i[12:], init_state=state[0])
+
+    def test_step_currents(self):
+        c = Circuit(PyBioNeuron([PyBioNeuron.default_params for _ in range(5)], 0.1), self.conns, self.gaps)
+        h = np.stack([c.init_state] * 2, 1)
+        i = np.ones((2, 5))
+        h, cur = c.step(h, i)
+        self.assertEqual(cur.shape, (2, 5))
+        curs_intern = np.swapaxes(c._inter_curr(h[0][:, c._pres], h[0][:, c._posts]), 0, 1)
+        for n in range(5):
+            np.testing.assert_allclose(cur[:, n], np.sum(curs_intern[c._posts == n], axis=0))
+        # neuron 1 receives no connection
+        np.testing.assert_array_equal(cur[:, 1], 0.)
@@ -42,6 +42,15 @@ class TestNeuronLSTM(TestCase):
         self.assertEqual(x.shape[1], 2)
         self.assertEqual(x.shape[2], 2)
 
+    def test_resume(self):
+        l = NeuronLSTM(2, 5, 1, 1)
+        i = np.random.uniform(0., 10., (10, 2))
+        x, state = l.calculate(i, return_state=True)
+        x1, s1 = l.calculate(i[:4], return_state=True)
+        x2 = l.calculate(i[4:], init_state=s1)
+        np.testing.assert_allclose(np.concatenate([x1, x2]), x, rtol=1e-5)
+        self.assertEqual(len(state), len(s1))
+
     def test_load(self):
         l = NeuronLSTM(4,5,6,1)
         l.reset()
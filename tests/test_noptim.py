@@ -6,6 +6,7 @@ from odynn.nsimul import simul
 from odynn import optim
 import tensorflow as tf
 import numpy as np
+import copy
 
 dir = utils.set_dir('unittest')
 dt = 0.5
@@ -31,6 +32,81 @@ class TestNeuronOpt(TestCase):
         w = [1] + [1 for _ in PyBioNeuron.ions.items()]
         co._build_loss(res, ys_, w)
 
+    def test_shooting_starts(self):
+        co = NeuronOpt(nr)
+        co._shooting = 2
+        co.n_batch = 3
+        co._shoot_default = np.stack([PyBioNeuron.default_init_state for _ in range(6)], axis=1)
+        v = np.random.rand(10, 3)
+        starts = co._shooting_starts([v] + [None for _ in range(len(PyBioNeuron.default_init_state) - 1)])
+        np.testing.assert_array_equal(starts[:, :3], co._shoot_default[:, :3])
+        np.testing.assert_array_equal(starts[0, 3:], v[4])
+        np.testing.assert_array_equal(starts[1:, 3:], co._shoot_default[1:, 3:])
+
+    def test_shooting_continuity(self):
+        # noise-free measurements of the true model
+        neuron = PyBioNeuron(default, dt=dt)
+        X = neuron.calculate(i)
+        co = NeuronOpt(nr)
+        co._shooting = 2
+        co.n_batch = i.shape[1]
+        seg = len(i) // 2
+        # the unmeasured variables are known, the measured ones come from the measurements
+        co._shoot_default = np.concatenate([np.broadcast_to(neuron.init_state[:, None], X[0].shape), X[seg - 1]],
+                                           axis=1)
+        co._shoot_default[[neuron.V_pos, -1], co.n_batch:] = 0.
+        starts = co._shooting_starts([X[:, neuron.V_pos], X[:, -1]])
+        ends = neuron.calculate(i[:seg], init_state=starts[:, :co.n_batch])[-1]
+        np.testing.assert_allclose(ends, starts[:, co.n_batch:], atol=1e-6)
+        np.testing.assert_allclose(neuron.calculate(i[seg:], init_state=starts[:, co.n_batch:]), X[seg:], atol=1e-6)
+
+    def test_checkpoint_grads(self):
+        co = NeuronOpt(BioNeuronTf(init_p=pars, dt=dt))
+        co._checkpoint = 4
+        w = [1 for _ in range(len(train[-1]))]
+        data = copy.deepcopy(train)
+        data[-1] = [y if y is not None else np.zeros_like(data[1]) for y in data[-1]]
+        xs_, ys_, res, data, _ = co._init(dir, '', data, None, (0.1, 9, 0.92), w, [None, None])
+        co._build_loss(res, ys_, w)
+        _, vars = co._build_chunk_grads()
+        # gradients of the loss with backpropagation through the whole traces
+        bptt = tf.gradients(tf.reduce_sum(co._loss), vars)
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            feed_d = {ys_[i]: m for i, m in enumerate(data[-1])}
+            feed_d[xs_] = data[1]
+            target = sess.run(bptt, feed_dict=feed_d)
+            # including chunks not dividing the length of the traces
+            for chunk in [2, 3, 4, len(data[1])]:
+                grads, results, _ = co._checkpoint_grads(sess, xs_, ys_, res, data, co._windows(len(data[1]), chunk))
+                self.assertEqual(len(results), len(data[1]))
+                for g, g_target in zip(grads, target):
+                    np.testing.assert_allclose(g, g_target, rtol=1e-3, atol=1e-6)
+
+    def test_minibatch_padding(self):
+        co = NeuronOpt(BioNeuronTf(init_p=pars, dt=dt))
+        co._batch_size = 2
+        w = [1 for _ in range(len(train[-1]))]
+        data = copy.deepcopy(train)
+        data[-1] = [y if y is not None else np.zeros_like(data[1]) for y in data[-1]]
+        xs_, ys_, res, data, _ = co._init(dir, '', data, None, (0.1, 9, 0.92), w, [None, None])
+        co._build_loss(res, ys_, w)
+        co._build_train()
+        co._epoch_fetches = {'rate': co.learning_rate}
+        out = []
+        with tf.Session() as sess:
+            # a short last minibatch padded with the first element, and the same element alone
+            for idx, mask in [([2, 0], [1., 0.]), ([2, 2], [1., 1.])]:
+                sess.run(tf.global_variables_initializer())
+                co._batch_feed = {co._batch_mask: np.array(mask, dtype=np.float32)}
+                _, _, loss = co._train_epoch(sess, xs_, ys_, res, co._take(data, idx), [slice(None)])
+                out.append((loss, sess.run(tf.trainable_variables())))
+        co._batch_feed = {}
+        # the padding changes neither the loss nor the update
+        np.testing.assert_allclose(out[0][0], out[1][0], rtol=1e-5)
+        for v, v_target in zip(out[0][1], out[1][1]):
+            np.testing.assert_allclose(v, v_target, rtol=1e-5)
+
     def test_settings(self):
         co = NeuronOpt(nr)
         train = [np.zeros(2), np.zeros(2), [None, None, None]]
@@ -50,6 +126,10 @@ class TestNeuronOpt(TestCase):
         train2 = train
         train2[-1][-1] = None
         n = opt.optimize(dir, w=w, train=train, epochs=1, plot=plot)
+        print('LSTM, windows'.center(40, '#'))
+        n = opt.optimize(dir, w=w, train=train, epochs=1, plot=plot, window=4)
+        print('LSTM, checkpoints'.center(40, '#'))
+        n = opt.optimize(dir, w=w, train=train, epochs=1, plot=plot, checkpoint=4)
         optim.get_model(dir)
         optim.get_vars_all(dir)
         t, tt = optim.get_data(dir)
@@ -66,9 +146,52 @@ class TestNeuronOpt(TestCase):
         n = opt.optimize(dir, w=w,  train=train, epochs=1, plot=plot)
         print('One neuron reload'.center(40, '#'))
         n = opt.optimize(dir, w=w,  reload=True, train=train, epochs=1, plot=plot)
+        print('One neuron with previous checkpoints'.center(40, '#'))
+        opt.freq_test = 1
+        opt.keep_snapshots = 1
+        n = opt.optimize(dir, w=w, train=train, epochs=3, plot=plot)
+        ckpt = tf.train.get_checkpoint_state(dir + utils.TMP_DIR, optim.CKPT_STATE)
+        self.assertEqual(len(ckpt.all_model_checkpoint_paths), 2)
+        self.assertTrue(ckpt.model_checkpoint_path.endswith('-2'))
+        opt.freq_test = 30
+        opt.keep_snapshots = 0
         print('One neuron with test'.center(40, '#'))
         n = opt.optimize(dir, w=w, train=train, test=train, epochs=1, plot=plot)
+        print('One neuron with sparse snapshots'.center(40, '#'))
+        opt.freq_vars = 2
+        opt.freq_summary = 2
+        n = opt.optimize(dir, w=w, train=train, epochs=3, plot=plot)
+        _, _, _, dic = optim._load_lv(dir)
+        for val in dic.values():
+            self.assertTrue(np.all(np.isnan(val[2])))
+            self.assertFalse(np.any(np.isnan(val[[1, 3]])))
+        opt.freq_vars = 1
+        opt.freq_summary = 1
+        print('One neuron with windows'.center(40, '#'))
+        n = opt.optimize(dir, w=w, train=train, epochs=2, plot=plot, window=3)
+        self.assertEqual(len(opt._state_in), len(opt._state_out))
+        print('One neuron with multiple shooting'.center(40, '#'))
+        n = opt.optimize(dir, w=w, train=train, test=train, epochs=1, plot=plot, shooting=2)
+        with self.assertRaises(ValueError):
+            opt.optimize(dir, w=w, train=train, epochs=1, plot=plot, shooting=3)
+        with self.assertRaises(ValueError):
+            opt.optimize(dir, w=w, train=train, epochs=1, plot=plot, shooting=2, window=3)
+        print('One neuron with checkpoints'.center(40, '#'))
+        n = opt.optimize(dir, w=w, train=train, epochs=1, plot=plot, checkpoint=4)
+        with self.assertRaises(ValueError):
+            opt.optimize(dir, w=w, train=train, epochs=1, plot=plot, checkpoint=4, window=3)
+
+
+        print('One neuron with minibatches'.center(40, '#'))
+        n = opt.optimize(dir, w=w, train=train, test=train, epochs=2, plot=plot, batch_size=2)
+        n = opt.optimize(dir, w=w, train=train, epochs=1, plot=plot, batch_size=3, shuffle=False, window=4)
+        with self.assertRaises(ValueError):
+            opt.optimize(dir, w=w, train=train, epochs=1, plot=plot, batch_size=2, shooting=2)
 
+        print('One neuron with input pipeline'.center(40, '#'))
+        n = opt.optimize(dir, w=w, train=train, test=train, epochs=2, plot=plot, batch_size=2, window=4, pipeline=True)
+        with self.assertRaises(ValueError):
+            opt.optimize(dir, w=w, train=train, epochs=1, plot=plot, checkpoint=4, pipeline=True)
 
         print('Parallel'.center(40, '#'))
         pars = [PyBioNeuron.get_random() for _ in range(2)]
@@ -76,4 +199,13 @@ class TestNeuronOpt(TestCase):
         self.assertEqual(opt._parallel, 2)
         n = opt.optimize(dir, w=w,  train=train, epochs=1, plot=plot)
         self.assertEqual(opt._loss.shape[0], opt._parallel)
+        n = opt.optimize(dir, w=w, train=train, test=train, epochs=1, plot=plot, pipeline=True)
+        print('Parallel reload with test'.center(40, '#'))
+        l, lt, _, _ = optim._load_lv(dir)
+        l, lt = np.array(l), np.array(lt)
+        n = opt.optimize(dir, w=w, reload=True, train=train, test=train, epochs=1, plot=plot)
+        l2, lt2, _, _ = optim._load_lv(dir)
+        self.assertEqual(l2.shape, (len(l) + 1, opt._parallel))
+        np.testing.assert_array_equal(l2[:len(l)], l)
+        np.testing.assert_array_equal(lt2[:len(lt)], lt)
 
@@ -33,4 +33,20 @@ class TestNeuronSimul(TestCase):
 
     def test_Sim(self):
         nfix = PyBioNeuron(self.pars)
-        sim.simul(neuron=nfix, dt=self.dt, i_inj=self.i)
\ No newline at end of file
+        sim.simul(neuron=nfix, dt=self.dt, i_inj=self.i)
+
+    def test_sweep(self):
+        ps = [PyBioNeuron.get_random() for _ in range(5)]
+        i = np.stack([self.i, 2 * self.i], axis=1)
+        target = PyBioNeuron(ps, dt=self.dt).calculate(i[..., None])
+        # two parameter sets per chunk
+        memory = target[..., :2].nbytes
+        chunks = [(c, X.copy()) for c, X in sim.sweep(iter(ps), dt=self.dt, i_inj=i, memory=memory)]
+        self.assertEqual([len(c) for c, _ in chunks], [2, 2, 1])
+        self.assertEqual(sum([c for c, _ in chunks], []), ps)
+        np.testing.assert_allclose(np.concatenate([X for _, X in chunks], axis=-1), target, rtol=1e-5, atol=1e-5)
+        feats = [f for _, f in sim.sweep(ps, dt=self.dt, i_inj=self.i, features=lambda X: X[:, 0].max(axis=0))]
+        self.assertEqual(np.concatenate(feats).shape, (len(ps),))
+        rec = [c for _, X in sim.sweep(ps, dt=self.dt, i_inj=i, memory=memory // 4, record=[0], every=4)
+               for c in np.moveaxis(X, -1, 0)]
+        np.testing.assert_allclose(np.stack(rec, axis=-1), target[::4][:, [0]], rtol=1e-5, atol=1e-5)
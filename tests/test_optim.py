@@ -24,6 +24,64 @@ class TestOptim(TestCase):
         loss_test = np.stack([loss_test for _ in range(7)], axis=-1)
         optim.plot_loss_rate(loss, rates, loss_test, save=False, show=False, parallel=7)
 
+    def test_windows(self):
+        self.assertEqual(optim.Optimizer._windows(10), [slice(None)])
+        w = optim.Optimizer._windows(10, 4)
+        self.assertEqual(w, [slice(0, 4), slice(4, 8), slice(8, 12)])
+        x = np.arange(10)
+        np.testing.assert_array_equal(np.concatenate([x[s] for s in w]), x)
+        with self.assertRaises(ValueError):
+            optim.Optimizer._windows(10, 0)
+        with self.assertRaises(ValueError):
+            optim.Optimizer._windows(10, 2.5)
+
+    def test_minibatches(self):
+        np.testing.assert_array_equal(optim.Optimizer._minibatches(5), [[0, 1, 2, 3, 4]])
+        b = optim.Optimizer._minibatches(5, 2)
+        np.testing.assert_array_equal(b, [[0, 1], [2, 3], [4, 0]])
+        b = optim.Optimizer._minibatches(5, 2, shuffle=True)
+        self.assertEqual(b.shape, (3, 2))
+        self.assertEqual(set(b.flatten()), set(range(5)))
+        with self.assertRaises(ValueError):
+            optim.Optimizer._minibatches(5, 6)
+        # each element counts once per epoch, the padding is masked
+        b = optim.Optimizer._minibatches(7, 3, shuffle=True)
+        mask = optim.Optimizer._minibatch_mask(b, 7)
+        np.testing.assert_array_equal(mask, [[1, 1, 1], [1, 1, 1], [1, 0, 0]])
+        np.testing.assert_array_equal(np.sort(b[mask > 0]), np.arange(7))
+        np.testing.assert_array_equal(optim.Optimizer._minibatch_mask(optim.Optimizer._minibatches(6, 3), 6), 1)
+        x = np.random.rand(4, 5, 2)
+        t, xb, ys = optim.Optimizer._take([np.arange(4), x, [x, None]], np.array([4, 1]))
+        np.testing.assert_array_equal(xb[:, 1], x[:, 1])
+        self.assertEqual(ys[0].shape, (4, 2, 2))
+        self.assertIsNone(ys[1])
+
+    def test_batch_state(self):
+        init = np.random.rand(3, 2)
+        state = optim.Optimized._batch_state(init, 4, init_state=lambda d: d)
+        self.assertEqual(state.shape, (3, 4, 2))
+        np.testing.assert_array_almost_equal(state[:, 2], init)
+        # broadcast, not copied
+        self.assertEqual(state.strides[1], 0)
+
+    def test_segments(self):
+
+        class opt(optim.Optimizer):
+            def _build_loss(self, w):
+                pass
+
+        op = opt(neuron.BioNeuronTf(n_rand=1))
+        op._shooting = 4
+        op.n_batch = 3
+        x = np.random.rand(20, 3)
+        t, xs, ys = op._segment_data([np.arange(20), x, [x, None]])
+        self.assertEqual(xs.shape, (5, 12))
+        # second batch of the third segment
+        np.testing.assert_array_equal(xs[:, 2 * 3 + 1], x[10:15, 1])
+        self.assertIsNone(ys[1])
+        res = np.stack([xs, 2 * xs], axis=1)
+        np.testing.assert_array_equal(op._unsegment(res), np.stack([x, 2 * x], axis=1))
+
     def test_init(self):
 
         class opt(optim.Optimizer):
@@ -0,0 +1,59 @@
+"""
+.. module::
+    :synopsis: Module doing stuff...
+
+.. moduleauthor:: Marc Javin
+"""
+
+from unittest import TestCase
+from odynn import parallel, nsimul, circuit
+from odynn.neuron import PyBioNeuron
+import numpy as np
+
+
+class TestParallel(TestCase):
+
+    i = 10. * np.random.rand(40, 3)
+
+    def test_shared_array(self):
+        a = np.random.rand(3, 4).astype(np.float32)
+        s = parallel.SharedArray.copy(a)
+        np.testing.assert_array_equal(s.view(), a)
+        s.view()[0] = 0
+        self.assertEqual(s.view()[0].sum(), 0)
+
+    def test_calculate(self):
+        neurons = PyBioNeuron([PyBioNeuron.get_random() for _ in range(4)])
+        np.testing.assert_array_equal(parallel.calculate(neurons, self.i[..., None], workers=2),
+                                      neurons.calculate(self.i[..., None]))
+        circ = circuit.Circuit(PyBioNeuron([PyBioNeuron.default_params for _ in range(2)]),
+                               synapses={(0, 1): circuit.SYNAPSE})
+        i = np.stack([self.i, self.i], axis=-1)
+        states, curs = circ.calculate(i)
+        for workers in [0, 2]:
+            res = parallel.calculate([circ, circ], i, workers=workers)
+            for r, target in zip(res, (states, curs)):
+                self.assertEqual(r.shape, (2,) + target.shape)
+                np.testing.assert_array_equal(r[1], target)
+
+    def test_calculate_unbatched(self):
+        neuron = PyBioNeuron()
+        i = self.i[:, 0]
+        # 1D input, for a model and a list of models
+        np.testing.assert_array_equal(parallel.calculate(neuron, i, workers=2), neuron.calculate(i))
+        res = parallel.calculate([neuron, neuron], i, workers=2)
+        self.assertEqual(res.shape, (2,) + neuron.calculate(i).shape)
+        np.testing.assert_array_equal(res[1], neuron.calculate(i))
+        # one column of the input per parameter set of a vectorised model
+        neurons = PyBioNeuron([PyBioNeuron.get_random() for _ in range(3)])
+        np.testing.assert_array_equal(parallel.calculate(neurons, self.i, workers=2), neurons.calculate(self.i))
+        np.testing.assert_array_equal(parallel.calculate(neurons, i, workers=2), neurons.calculate(i))
+
+    def test_sweep(self):
+        ps = [PyBioNeuron.get_random() for _ in range(5)]
+        memory = len(self.i) * len(PyBioNeuron.default_init_state) * 3 * 2 * 8
+        serial = [(c, X.copy()) for c, X in nsimul.sweep(ps, i_inj=self.i, memory=memory)]
+        pool = [(c, X.copy()) for c, X in nsimul.sweep(iter(ps), i_inj=self.i, memory=memory, workers=2)]
+        self.assertEqual([c for c, _ in pool], [c for c, _ in serial])
+        for (_, X), (_, Y) in zip(pool, serial):
+            np.testing.assert_array_equal(X, Y)
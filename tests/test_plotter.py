@@ -0,0 +1,35 @@
+"""
+.. module::
+    :synopsis: Module doing stuff...
+
+.. moduleauthor:: Marc Javin
+"""
+
+from unittest import TestCase
+from odynn import plotter, utils
+import os
+
+
+class TestPlotter(TestCase):
+
+    def test_latest_wins(self):
+        dir = utils.set_dir('unittest')
+        paths = [dir + 'plot%s' % k for k in range(4)]
+        for p in paths:
+            if os.path.exists(p):
+                os.remove(p)
+        with plotter.Plotter(processes=2, interval=100.) as plots:
+            for k, p in enumerate(paths[:3]):
+                plots.submit('a', utils.write_file, bytes([k]), p)
+            plots.submit('b', utils.write_file, b'b', paths[3])
+        # the first job starts at once, the second is replaced by the third one before the interval
+        self.assertEqual([os.path.exists(p) for p in paths], [True, False, True, True])
+
+        with plotter.Plotter(processes=0) as plots:
+            plots.submit('a', utils.write_file, b'', paths[1])
+        self.assertTrue(os.path.exists(paths[1]))
+
+        plots = plotter.Plotter()
+        plots.submit('a', int, 'a')
+        with self.assertRaises(ValueError):
+            plots.close()
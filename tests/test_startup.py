@@ -0,0 +1,47 @@
+"""
+.. module::
+    :synopsis: Module doing stuff...
+
+.. moduleauthor:: Marc Javin
+"""
+
+from unittest import TestCase
+import json
+import os
+import subprocess
+import sys
+import odynn
+
+STARTUP_BUDGET = 1.5
+"""float, maximum time in seconds to import the simulation modules"""
+
+HEAVY = ['tensorflow', 'tqdm', 'pylab', 'matplotlib', 'seaborn', 'pandas', 'networkx', 'scipy']
+
+CODE = """
+import json, sys, time
+import numpy as np
+start = time.time()
+import odynn.nsimul, odynn.csimul
+elapsed = time.time() - start
+from odynn.neuron import PyBioNeuron
+from odynn.circuit import Circuit
+PyBioNeuron().calculate(np.zeros(100))
+neurons = PyBioNeuron([PyBioNeuron.default_params for _ in range(2)])
+Circuit(neurons, synapses={(0, 1): odynn.circuit.SYNAPSE}).calculate(np.zeros((100, 2)))
+# the optimizers only load TensorFlow when building their graph
+import odynn.noptim, odynn.coptim
+print(json.dumps([elapsed, [m for m in %r if m in sys.modules]]))
+""" % HEAVY
+
+
+class TestStartup(TestCase):
+
+    def test_startup(self):
+        # in a new interpreter, the other tests load everything
+        env = dict(os.environ)
+        root = os.path.dirname(os.path.dirname(os.path.abspath(odynn.__file__)))
+        env['PYTHONPATH'] = os.pathsep.join([root] + [p for p in [env.get('PYTHONPATH')] if p])
+        out = subprocess.check_output([sys.executable, '-c', CODE], env=env)
+        elapsed, loaded = json.loads(out.decode().splitlines()[-1])
+        self.assertEqual(loaded, [])
+        self.assertLess(elapsed, STARTUP_BUDGET)
@@ -0,0 +1,36 @@
+"""
+.. module::
+    :synopsis: Module doing stuff...
+
+.. moduleauthor:: Marc Javin
+"""
+
+from unittest import TestCase
+from odynn import trainlog, utils
+import os
+import numpy as np
+
+
+class TestTrainLog(TestCase):
+
+    def test_log(self):
+        path = utils.set_dir('unittest') + 'log'
+        with trainlog.TrainLog(path, {'loss': (3,), 'rate': (), 'vars/C_m': (2, 3)}) as log:
+            self.assertTrue(trainlog.exists(path))
+            self.assertEqual(list(trainlog.columns(path).items()), [('loss', (3,)), ('rate', ()), ('vars/C_m', (2, 3))])
+            log.extend({'loss': np.ones((2, 3)), 'vars/C_m': np.zeros((2, 2, 3))})
+            log.append({'loss': 2., 'rate': 0.1})
+            # readable while being written
+            loss = trainlog.read(path, 'loss')
+            np.testing.assert_array_equal(loss, [[1, 1, 1], [1, 1, 1], [2, 2, 2]])
+            self.assertEqual(trainlog.read(path, 'vars/C_m').shape, (2, 2, 3))
+        np.testing.assert_array_almost_equal(trainlog.read(path, 'rate'), [0.1])
+        # an incomplete record is ignored
+        with open(os.path.join(path, '0.bin'), 'ab') as f:
+            f.write(b'\0\0\0\0')
+        self.assertEqual(len(trainlog.read(path, 'loss')), 3)
+        with self.assertRaises(KeyError):
+            trainlog.read(path, 'loss_test')
+
+        trainlog.TrainLog(path, {'loss': (3,)}).close()
+        self.assertEqual(trainlog.read(path, 'loss').shape, (0, 3))
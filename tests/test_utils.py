@@ -41,3 +41,33 @@ class TestOptim(TestCase):
         self.assertEqual(a, '#ffffff')
         a = utils.colorscale('#aaaaaa', 0.5)
         self.assertEqual(a, '#555555')
+
+    def test_chunks(self):
+        a = np.arange(10)
+        self.assertEqual([len(c) for c in utils.chunks(a, 4)], [4, 4, 2])
+        self.assertEqual([len(c) for c in utils.chunks(a)], [10])
+        pieces = [a[:3], a[3:4], a[4:]]
+        chunks = list(utils.chunks(iter(pieces), 4))
+        self.assertEqual([len(c) for c in chunks], [4, 4, 2])
+        np.testing.assert_array_equal(np.concatenate(chunks), a)
+        self.assertEqual([len(c) for c in utils.chunks(pieces)], [3, 1, 6])
+
+    def test_async_writer(self):
+        path = utils.set_dir('unittest') + 'writer'
+        done = []
+        with utils.AsyncWriter(maxsize=2) as writer:
+            for k in range(5):
+                writer.submit(done.append, k)
+            for k in range(3):
+                writer.submit(utils.write_file, bytes([k]), path, keep=1)
+        self.assertEqual(done, list(range(5)))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), bytes([2]))
+        with open(path + '.1', 'rb') as f:
+            self.assertEqual(f.read(), bytes([1]))
+        self.assertFalse(os.path.exists(path + '.2'))
+
+        writer = utils.AsyncWriter()
+        writer.submit(int, 'a')
+        with self.assertRaises(ValueError):
+            writer.close()